@@ -0,0 +1,43 @@
+########################################################################
+###    Crash-safe file output. Data is written to a temporary file   ###
+###    in the target directory and renamed over the target, so a     ###
+###    preempted job never leaves a truncated file behind.           ###
+########################################################################
+
+
+import json
+import os
+import tempfile
+
+from contextlib import contextmanager
+
+
+# Permissions open() would give a new file; mkstemp only allows the owner
+umask = os.umask(0)
+os.umask(umask)
+
+
+""" Open a temporary file that replaces path once the block completes """
+@contextmanager
+def atomic_open(path, mode='w'):
+
+    # Unique on every host sharing the directory, unlike a pid suffix
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+            prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            os.fchmod(f.fileno(), 0o666 & ~umask)
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+""" Atomically write a json file """
+def dump_json(path, obj, **kwargs):
+    with atomic_open(path, 'w') as f:
+        json.dump(obj, f, **kwargs)
@@ -15,9 +15,12 @@
 import numpy as np
 import glob
 import re
-import healpy as hp
 from datetime import datetime, time
 
+from fits_counts import count_events
+from grl import load_grl, bad_runs
+from file_catalog import open_catalog, refresh, find, fits_match, fits_descend
+
 # File locations
 prefix = '/data/user/eschmidt/stability'  
 files = sorted(glob.glob(f'{prefix}/summarized_days/*.txt'))
@@ -27,38 +30,34 @@ configs = sorted(set([re.findall('IC86-\d{4}', f)[-1] for f in files]))
 print('finding bad run list')
 
 # list/dictionary initation
-badruns = []
 livetime = {}
 
-# open I3 good run list 
+# load I3 good run list
 file = f'{prefix}/goodrunlist/goodrunslist.txt'
-f = open(file, "r")
+grl = load_grl(file)
 
-# read data and separate each entry with keyword 'good_i3'
-data = f.readlines()
-check = sorted([ct for ct, d in enumerate(data) if 'good_i3' in d])
+# runs are bad if either the in-ice or IceTop detector was bad
+badruns = [str(run) for run in bad_runs(grl, icetop=True)]
 
-# go through each entry to determine whether they are good or bad runs
-for r in check:
+# go through each entry to determine run times
+for run_info in grl:
     # instate each day as a key for the dictionary
-    day = data[r+2][27:37]
+    start_t = run_info['tstart'].astype('M8[s]').item()
+    day = start_t.strftime('%Y-%m-%d')
     if day not in livetime.keys():
         livetime[day] = {}
-    # determine if a day's run if good/bad
-    run = data[r+6][18:24]
-    if data[r][22:-2] == 'false' or data[r+1][22:-2] == 'false':
-        badruns.append(run)
+    run = str(run_info['run'])
     # set livetime to null if not calculatable
-    if data[r+3][25:29] == 'null':
+    if np.isnat(run_info['tstop']):
         livetime[day][run] = 'null'
         continue
-    # obtain start/stop times from list
-    start_t = datetime.strptime(data[r+2][29:46], '%y-%m-%d %H:%M:%S')
-    stop_t = datetime.strptime(data[r+3][28:45], '%y-%m-%d %H:%M:%S')
+    # obtain stop time from list
+    stop_t = run_info['tstop'].astype('M8[s]').item()
     # check if run crosses over a day and create appropriate run times
     if start_t.day != stop_t.day:
-        day_aft = data[r+3][26:36]
-        livetime[day_aft] = {}
+        day_aft = stop_t.strftime('%Y-%m-%d')
+        if day_aft not in livetime.keys():
+            livetime[day_aft] = {}
         midnight = datetime.combine(stop_t, time.min)
         run_sec_prev = (midnight - start_t).seconds
         run_sec_aft = (stop_t - midnight).seconds
@@ -68,9 +67,6 @@ for r in check:
     else:
         run_sec = (stop_t - start_t).seconds
         livetime[day][run] = run_sec
-# organize badruns into reasonable list
-badruns = sorted(set(badruns))
-f.close()
 
 # find bad days in fits files
 print('finding bad days in fits')
@@ -121,6 +117,9 @@ times = np.load(f'{fm_livetime}/livetime.npy', allow_pickle=True)
 times = times.item()
 fm_prefix = '/data/user/fmcnally/anisotropy/maps'
 fits_data = {}
+# fits maps are listed by the file catalog
+db = open_catalog()
+refresh(db, 'fits', fm_prefix, fits_match, fits_descend)
 
 # run through each configuration
 for c in configs:
@@ -128,22 +127,20 @@ for c in configs:
     valid_dates = sorted(times[c])
     rate_lst = []
     # Retrieve fits files
-    fits_files = glob.glob(f'{fm_prefix}/{c}/*sid_????-??-??.fits')
-    fits_files.sort()
+    fits_files = find(db, 'fits', c, top=fm_prefix)
     n = {}
     nfiles = len(fits_files)
     
     # run through each fits file
-    for i, f in enumerate(fits_files):
+    for i, (f, cfg, day, run) in enumerate(fits_files):
         # read fits file
-        map_i = hp.read_map(f, verbose=0)
-        day = re.split('_|\.', f)[-2]
+        n_i = count_events(f)
         # check for valid date
         if day not in valid_dates:
             print(f'Warning: {day} has no good runs in i3live!')
             continue
         # save information in dictionary
-        n[day] = {'nEvents': map_i.sum(), 'livetime':times[c][day]}
+        n[day] = {'nEvents': n_i, 'livetime':times[c][day]}
     # save config data in fits_data
     fits_data[c] = n
     
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 import argparse
 import numpy as np
-import ROOT
+
+from dst_readers import get_reader
+from job_plan import load_job
+from run_aggregates import aggregate, merge, summary_lines
+from run_aggregates import save_gaps, save_counts
 
 # Super complicated calculation to convert MJD time to yr-month-day
 def conv_MJD(day):
@@ -39,53 +43,51 @@ if __name__ == "__main__":
     p.add_argument('-y', '--year', dest='year',
             type=int, default=2015,
             help='Detector season (e.g., 2011 = IC86-2011)')
+    p.add_argument('--backend', dest='backend',
+            default='auto', choices=['auto', 'uproot', 'root'],
+            help='ROOT file reader (auto prefers uproot, falling back to PyROOT)')
+    p.add_argument('--chunk', dest='chunk',
+            type=int, default=1000000,
+            help='Number of tree entries read per chunk')
+    p.add_argument('--manifest', dest='manifest',
+            default=None,
+            help='Job plan written by day_submitter.py, replaces -i/-o')
+    p.add_argument('--job', dest='job',
+            type=int, default=0,
+            help='Index of the job to run from the manifest')
     args = p.parse_args()
 
     # Collect all files from specified year
     prefix = '/data/ana/CosmicRay/Anisotropy/IceCube'
 
-    run_nums = []
-    file_dict = {}
-    
-    # Run through each input file
-    for infile in args.infiles:
+    # Reader for the CutDST trees (PyROOT or pure-Python uproot)
+    reader = get_reader(args.backend)
+    print(f'Reading with the {reader.name} backend')
+
+    # A job from a submitter plan can cover several dates
+    if args.manifest != None:
+        tasks = load_job(args.manifest, args.job)
+    else:
+        tasks = [{'infiles':args.infiles, 'out':args.out}]
+
+    for task in tasks:
+
+        agg = merge([])
+
+        # Run through each input file
+        for src, infile in enumerate(task['infiles']):
 
-        # Open root file and retrieve nEvents
-        f = ROOT.TFile(infile)
-        t = f.CutDST
-        rootEvents = t.GetEntries()  
+            print('obtaining events now')
 
-        print('obtaining events now')
+            # aggregate nEvents and min/max time per run for each chunk of events
+            with reader(infile) as f:
+                for entry0, mjd, run in f.chunks(args.chunk):
+                    agg = merge([agg, aggregate(mjd, run, entry0, src)])
 
-        # run through each event
-        for i in range(rootEvents):
-            t.GetEntry(i)
-            # note day, run, and time
-            date = int(t.ModJulDay)
-            run = t.RunId
-            time = t.ModJulDay
-            # use days as keys in file's dictionary
-            if date not in file_dict.keys():
-                file_dict[date] = {}
-            # use run # as keys in day's dictionary 
-            if run not in file_dict[date].keys():
-                file_dict[date][run] = {'nEvents' : 0, 'max_time': time, 'min_time': time}
-            # count each Event per run
-            file_dict[date][run]['nEvents'] += 1
-            # compare event time to min/max time to determine run's min/max time
-            if time > file_dict[date][run]['max_time']:
-                file_dict[date][run]['max_time'] = time
-            if time < file_dict[date][run]['min_time']:
-                file_dict[date][run]['min_time'] = time
-                
-    day_info = []
-    # interate through dictionary to calculate livetime, nEvents, and day
-    for d, r in file_dict.items():
-        for runs, info in file_dict[d].items():
-            livetime = (info["max_time"] - info["min_time"])*86400
-            day_info.append(f'{conv_MJD(d)} - {runs} - {info["nEvents"]} - {int(livetime)}')
-            #livetime = (file_dict[date][runs]["max_time"] - file_dict[date][runs]["min_time"])*86400
-            #day_info.append(f'{conv_MJD(d)} - {runs} - {file_dict[d][runs]["nEvents"]} - {int(livetime)}')
-    # save information in text file
-    np.savetxt(args.out, day_info, fmt='%s')
-    
\ No newline at end of file
+        # calculate livetime, nEvents, and day for every run
+        day_info = summary_lines(agg, conv_MJD)
+        # save information in text file
+        np.savetxt(task['out'], day_info, fmt='%s')
+        # time gaps, gap-corrected livetime and binned counts from the same pass
+        save_gaps(task['out'], agg)
+        save_counts(task['out'], agg)
@@ -1,18 +1,24 @@
 #!/usr/bin/env python
 
-from npx4.pysubmit import pysubmit
 import argparse
-import glob
 import re
+import sys
 import os
 
+from job_plan import task_weight, write_plan, plan_path
+from file_catalog import default_catalog, open_catalog, refresh, \
+        files_by_date, root_match
+from job_array import submit_prefix
+from executors import ClusterExecutor, LocalExecutor
+
 if __name__ == "__main__":
 
     p = argparse.ArgumentParser(
             description='Cluster submission for timegaps.py. Creates histogram of all the time gaps in a day, finds the largest time gap of the day and the cumulative time gap')
     p.add_argument('--test', dest='test',
             default=False, action='store_true',
-            help='Option for running off cluster to test')
+            help='Option for running off cluster to test: the first two ' + \
+            'dates run with the local executor')
     p.add_argument('-y', '--year', dest='year',
             type=int,
             help='Detector season (e.g., 2011 = IC86-2011)')
@@ -22,20 +28,61 @@ if __name__ == "__main__":
     p.add_argument('-o', '--outDir', dest='outDir',
             default='/data/user/eschmidt/stability/summarized_days',
             help='Output directory')
+    p.add_argument('--backend', dest='backend',
+            default='root', choices=['root', 'uproot'],
+            help='ROOT reader used by the jobs. uproot runs on plain ' + \
+            'worker nodes without the cvmfs icetray environment')
+    p.add_argument('--balance', dest='balance',
+            default='bytes', choices=['bytes', 'entries'],
+            help='Balance jobs by total input bytes or CutDST entries')
+    p.add_argument('--target', dest='target',
+            type=float, default=60,
+            help='Target job duration in minutes')
+    p.add_argument('--throughput', dest='throughput',
+            type=float, default=None,
+            help='Bytes (or entries) per second processed by one job')
+    p.add_argument('--plan', dest='plan',
+            default=None,
+            help='Job plan manifest (default: a new ' + \
+            'plan_IC86-YYYY_<time>_<pid>.json in outDir, or in submitDir ' + \
+            'with --test or --dry-run)')
+    p.add_argument('--submitDir', dest='submitDir',
+            default=submit_prefix,
+            help='Directory for the job-array submit file, arguments and logs')
+    p.add_argument('--catalog', dest='catalog',
+            default=default_catalog,
+            help='File catalog database, refreshed for the season before use')
+    p.add_argument('--executor', dest='executor',
+            default='cluster', choices=['cluster', 'local'],
+            help='Submit jobs as a cluster job array, or run them in a ' + \
+            'pool of processes on this node')
+    p.add_argument('--jobs', dest='jobs',
+            type=int, default=4,
+            help='Jobs running at once with the local executor')
+    p.add_argument('--retries', dest='retries',
+            type=int, default=1,
+            help='Extra attempts for a failed job with the local executor')
+    p.add_argument('--dry-run', dest='dry_run',
+            default=False, action='store_true',
+            help='Write the submit description and task manifests only')
     args = p.parse_args()
 
-    # Collect all files from specified year
+    # Collect all files from specified year through the file catalog
     prefix = '/data/ana/CosmicRay/Anisotropy/IceCube'
-    if args.year >= 2016:
-        files = glob.glob(f'{prefix}/IC86-{args.year}/*/*.root')
-    else:
-        files = glob.glob(f'{prefix}/IC86-{args.year}/*.root')
-    files.sort()
+    season = f'{prefix}/IC86-{args.year}'
+    db = open_catalog(args.catalog)
+    refresh(db, 'root', season, root_match)
 
-
-    # Group all files according to a given date or run
-    batches = set([re.findall('\d{4}-\d{2}-\d{2}', f)[-1] for f in files])
-    batches = sorted(batches)
+    # Group all files according to a given date or run. Files sit in
+    # per-date subdirectories from 2016 on
+    depth = 1 if args.year >= 2016 else 0
+    batches = files_by_date(db, 'root', f'IC86-{args.year}', top=season)
+    batches = {dr:[f for f in dr_files
+            if f[len(season)+1:].count('/') == depth]
+            for dr, dr_files in batches.items()}
+    batches = {dr:dr_files for dr, dr_files in batches.items() if dr_files}
+    if args.test:
+        batches = dict(sorted(batches.items())[:2])
 
     # Environment for script
     cvmfs = '/cvmfs/icecube.opensciencegrid.org/py3-v4.1.1/icetray-start'
@@ -43,28 +90,47 @@ if __name__ == "__main__":
     header = [f'#!/bin/sh {cvmfs}', f'#METAPROJECT {meta}']
     # ROOT tools not automatically loaded
     header += ['export PYTHONPATH="$PYTHONPATH:${SROOT}/lib"']
+    # uproot only needs a python with numpy/uproot, no icetray or PyROOT
+    if args.backend == 'uproot':
+        header = ['#!/bin/sh']
     # Request increased memory: 8 GB, overkill (shouldn't need more than 4)
     sublines = ["request_memory = 2000"]  
 
-    # Run over all (d)ates or (r)uns
-    for dr in batches:
-
-        # Limit to relevant files
-        dr_files = sorted([f for f in files if dr in f])
+    # One task for each (d)ate or (r)un
+    tasks = []
+    for dr, dr_files in sorted(batches.items()):
 
         # Prepare output filenames
         # Assumes all dates/runs belong to just one detector configuration
         config = re.findall('IC86-\d{4}', dr_files[0])[-1]
-        out = f'{args.outDir}/num_{config}_{dr}.txt'
-
-        # Run
-        dr_files = ' '.join(dr_files)
-        if args.mid:
-                cmd = f'{os.getcwd()}/day_run_num.py -i {dr_files} -o {out} -y {args.year}'
-        
         out = f'{args.outDir}/sum_{config}_{dr}.txt'
-        cmd = f'{os.getcwd()}/day_run_num_24H.py -i {dr_files} -o {out} -y {args.year}'
 
-        
-        print(cmd)
-        pysubmit(cmd, test=args.test, header=header, sublines = sublines)
+        weight = task_weight(dr_files, args.balance, args.backend)
+        tasks += [{'date':dr, 'infiles':dr_files, 'out':out, 'weight':weight}]
+
+    # Pack dates into jobs of similar size. Every submission gets its own
+    # plan, as queued jobs find their dates by index into it. Test and dry
+    # runs keep theirs out of outDir
+    plan = args.plan
+    if plan == None:
+        plan_dir = args.outDir
+        if args.test or args.dry_run:
+            plan_dir = args.submitDir
+        os.makedirs(plan_dir, exist_ok=True)
+        plan = plan_path(plan_dir, f'IC86-{args.year}')
+    jobs = write_plan(plan, tasks, balance=args.balance,
+            target_minutes=args.target, throughput=args.throughput)
+
+    # Run every job as one task, as a cluster job array or locally
+    cmd = f'{os.getcwd()}/day_run_num_24H.py'
+    cmd += f' -y {args.year} --backend {args.backend}'
+    arglines = [f'--manifest {plan} --job {job}' for job in range(len(jobs))]
+    if args.executor == 'local' or args.test:
+        executor = LocalExecutor(args.submitDir, jobs=args.jobs,
+                retries=args.retries, dry_run=args.dry_run)
+    else:
+        executor = ClusterExecutor(args.submitDir, sublines,
+                dry_run=args.dry_run)
+    failed = executor.run(f'day_IC86-{args.year}', cmd, arglines, header)
+    if failed != []:
+        sys.exit(1)
@@ -0,0 +1,112 @@
+########################################################################
+###    Reader backends for the CutDST tree. Each backend opens one   ###
+###    ROOT file and yields ModJulDay/RunId as numpy array chunks.   ###
+###    'uproot' is pure Python and needs no icetray/cvmfs setup;     ###
+###    'root' uses PyROOT and is kept for the icetray environment.   ###
+########################################################################
+
+
+import numpy as np
+
+
+branches = ['ModJulDay', 'RunId']
+
+
+""" Copy a TTree::Draw result buffer into a numpy array """
+def draw_buffer(buf, n):
+    # Older PyROOT buffers need their length set before use
+    if hasattr(buf, 'SetSize'):
+        buf.SetSize(n)
+    return np.frombuffer(buf, dtype=np.float64, count=n).copy()
+
+
+class RootReader:
+
+    name = 'root'
+
+    def __init__(self, path):
+        import ROOT
+        self.path = path
+        self.f = ROOT.TFile.Open(path)
+        if not self.f or self.f.IsZombie():
+            raise IOError(f'Unable to open {path}')
+        self.t = self.f.Get('CutDST')
+
+    def num_entries(self):
+        return int(self.t.GetEntries())
+
+    """ Yield (first entry, ModJulDay, RunId) for entries [start, stop) """
+    def chunks(self, chunk_size, start=0, stop=None):
+        if stop is None:
+            stop = self.num_entries()
+        self.t.SetEstimate(chunk_size + 1)
+        for entry0 in range(start, stop, chunk_size):
+            n = min(chunk_size, stop - entry0)
+            n = self.t.Draw(':'.join(branches), '', 'goff', n, entry0)
+            mjd = draw_buffer(self.t.GetV1(), n)
+            run = draw_buffer(self.t.GetV2(), n)
+            yield entry0, mjd, run
+
+    def close(self):
+        if self.f:
+            self.f.Close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UprootReader:
+
+    name = 'uproot'
+
+    def __init__(self, path):
+        import uproot
+        self.path = path
+        self.f = uproot.open(path)
+        self.t = self.f['CutDST']
+
+    def num_entries(self):
+        return int(self.t.num_entries)
+
+    """ Yield (first entry, ModJulDay, RunId) for entries [start, stop) """
+    def chunks(self, chunk_size, start=0, stop=None):
+        if stop is None:
+            stop = self.num_entries()
+        entry0 = start
+        for arrays in self.t.iterate(branches, library='np',
+                step_size=chunk_size, entry_start=start, entry_stop=stop):
+            mjd = arrays['ModJulDay']
+            yield entry0, mjd, arrays['RunId']
+            entry0 += len(mjd)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+readers = {'uproot': UprootReader, 'root': RootReader}
+
+
+""" Pick a reader class, preferring uproot when it is installed """
+def get_reader(backend='auto'):
+
+    if backend != 'auto':
+        return readers[backend]
+
+    try:
+        import uproot
+    except ImportError:
+        return RootReader
+
+    return UprootReader
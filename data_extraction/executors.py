@@ -0,0 +1,106 @@
+########################################################################
+###    Executors for the submitters. Both run the same wrapper script ###
+###    with one line of arguments per task: the cluster executor      ###
+###    queues them as an HTCondor job array, the local executor runs  ###
+###    them on this node a few at a time with per-task logs, retries  ###
+###    and a summary of exit statuses.                               ###
+########################################################################
+
+
+import subprocess
+import shlex
+import time
+
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_io import dump_json
+from job_array import write_wrapper, write_array, submit_array
+
+
+class ClusterExecutor:
+
+    """ sublines: extra lines for the submit description """
+    def __init__(self, submit_dir, sublines=[], dry_run=False):
+        self.submit_dir = submit_dir
+        self.sublines = sublines
+        self.dry_run = dry_run
+
+    """ Submit every task as one job of a job array. Failures are only known
+        to the cluster, so no failed tasks are returned """
+    def run(self, name, cmd, arglines, header):
+
+        submit = write_array(self.submit_dir, name, cmd, arglines, header,
+                self.sublines)
+        submit_array(submit, len(arglines), dry_run=self.dry_run)
+
+        return []
+
+
+class LocalExecutor:
+
+    """ jobs: tasks running at once, retries: extra attempts for a task
+        with a non-zero exit status """
+    def __init__(self, submit_dir, jobs=4, retries=1, dry_run=False):
+        self.submit_dir = submit_dir
+        self.jobs = jobs
+        self.retries = retries
+        self.dry_run = dry_run
+
+    """ Run one task until it succeeds or runs out of attempts. Output of
+        every attempt goes to the task's .out and .err logs """
+    def run_task(self, executable, name, task, argline):
+
+        out = f'{self.submit_dir}/logs/{name}_{task}.out'
+        err = f'{self.submit_dir}/logs/{name}_{task}.err'
+        cmd = [executable] + shlex.split(argline)
+
+        t0 = time.time()
+        for attempt in range(1, self.retries + 2):
+            mode = 'w' if attempt == 1 else 'a'
+            with open(out, mode) as f_out, open(err, mode) as f_err:
+                for f in [f_out, f_err]:
+                    f.write(f'## Attempt {attempt}: {argline}\n')
+                    f.flush()
+                status = subprocess.run(cmd, stdout=f_out,
+                        stderr=f_err).returncode
+            if status == 0:
+                break
+            print(f'Task {task} exited with status {status} ' + \
+                    f'(attempt {attempt})')
+
+        return {'task':task, 'args':argline, 'status':status,
+                'attempts':attempt, 'seconds':round(time.time() - t0, 1),
+                'out':out, 'err':err}
+
+    """ Run every task, at most jobs at a time. The exit status of each task
+        is saved to <name>_status.json in the submit directory. Returns the
+        failed tasks """
+    def run(self, name, cmd, arglines, header):
+
+        executable = write_wrapper(self.submit_dir, name, cmd, header)
+        if self.dry_run:
+            print(f'Dry run: {len(arglines)} task(s) would run locally ' + \
+                    f'with {executable}')
+            return []
+
+        # Threads only wait on the task processes, so they bound how many
+        # processes run at once
+        print(f'Running {len(arglines)} task(s), {self.jobs} at a time...')
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(self.run_task, repeat(executable),
+                    repeat(name), range(len(arglines)), arglines))
+
+        statusfile = f'{self.submit_dir}/{name}_status.json'
+        dump_json(statusfile, results, indent=2)
+
+        # Summary
+        failed = [r for r in results if r['status'] != 0]
+        retried = [r for r in results if r['status'] == 0 and r['attempts'] > 1]
+        print(f'{len(results) - len(failed)}/{len(results)} task(s) ' + \
+                f'succeeded, {len(retried)} after retries')
+        for r in failed:
+            print(f'Task {r["task"]} failed with status {r["status"]}: {r["err"]}')
+        print(f'Exit statuses saved to {statusfile}')
+
+        return failed
@@ -0,0 +1,67 @@
+########################################################################
+###    Persistent cache of per-file (day, run) partial aggregates.   ###
+###    Entries are keyed on the ROOT file's path, size, mtime and    ###
+###    inode, so only new or regenerated files need to be decoded.   ###
+########################################################################
+
+
+import numpy as np
+import hashlib
+import json
+import os
+
+from atomic_io import atomic_open
+from run_aggregates import make_dtype, bin_width
+
+
+""" Identity of a file on disk: path, size, mtime and inode """
+def file_identity(path):
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size,
+            'mtime': st.st_mtime_ns, 'inode': st.st_ino}
+
+
+""" Cache entry location for a file, fanned out over subdirectories """
+def entry_path(cache_dir, identity):
+    key = hashlib.sha1(identity['path'].encode()).hexdigest()
+    return f'{cache_dir}/{key[:2]}/{key}.npz'
+
+
+""" Cached aggregate for a file, or None if missing, out of date or made
+    with different extraction options """
+def load_entry(cache_dir, identity, options={}):
+
+    entry = entry_path(cache_dir, identity)
+    if not os.path.isfile(entry):
+        return None
+
+    try:
+        with np.load(entry) as npz:
+            stored = json.loads(str(npz['identity']))
+            stored_options = json.loads(str(npz['options']))
+            agg = npz['agg']
+    except (OSError, ValueError, KeyError):
+        print(f'Warning: unreadable cache entry {entry}, ignoring')
+        return None
+
+    if stored != identity or stored_options != options:
+        return None
+    if agg.dtype != make_dtype(options.get('bin_width', bin_width)):
+        return None
+
+    return agg
+
+
+""" Store a file's aggregate, replacing any older entry atomically """
+def save_entry(cache_dir, identity, agg, options={}):
+
+    entry = entry_path(cache_dir, identity)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+    # Aggregates are stored relative to their own file
+    agg = agg.copy()
+    agg['src'] = 0
+
+    with atomic_open(entry, 'wb') as f:
+        np.savez(f, agg=agg, identity=np.array(json.dumps(identity)),
+                options=np.array(json.dumps(options)))
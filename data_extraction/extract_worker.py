@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+########################################################################
+###    Long-running extraction worker. Watches a spool directory     ###
+###    for tasks (input files + output path), runs the columnar      ###
+###    engine on them and keeps a bounded pool of open ROOT files,   ###
+###    so interpreter start and PyROOT import are paid only once.    ###
+###                                                                  ###
+###    Queue a task:  extract_worker.py -s SPOOL --submit -i ... -o  ###
+###    Run a worker:  extract_worker.py -s SPOOL                     ###
+########################################################################
+
+
+import argparse
+import json
+import os
+import signal
+import time
+import traceback
+
+import numpy as np
+from collections import OrderedDict
+
+from atomic_io import dump_json
+from dst_readers import get_reader
+from extract_cache import file_identity, load_entry, save_entry
+from root_extractor import mjd2iso
+from run_aggregates import aggregate, merge, summary_lines
+from run_aggregates import save_gaps, save_counts, gap_threshold, bin_width
+
+
+# Task life cycle: new -> work -> done | failed
+stages = ['new', 'work', 'done', 'failed']
+
+
+class HandlePool:
+
+    """ Least-recently-used set of open reader handles """
+    def __init__(self, reader, size):
+        self.reader = reader
+        self.size = size
+        self.handles = OrderedDict()
+
+    """ Open handle for a file, reopening it if the file changed on disk """
+    def get(self, path):
+
+        identity = file_identity(path)
+        key = (identity['path'], identity['size'], identity['mtime'],
+                identity['inode'])
+        if key in self.handles:
+            self.handles.move_to_end(key)
+            return self.handles[key]
+
+        # Drop handles to older versions of the same file
+        for old_key in [k for k in self.handles if k[0] == key[0]]:
+            self.handles.pop(old_key).close()
+
+        # Close the least recently used files to stay within the limit
+        while len(self.handles) >= self.size:
+            old_key, handle = self.handles.popitem(last=False)
+            handle.close()
+
+        self.handles[key] = self.reader(path)
+        return self.handles[key]
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+
+""" Queue an extraction task in the spool directory """
+def submit_task(spool, infiles, out):
+    name = f'{time.time_ns()}_{os.getpid()}.json'
+    dump_json(f'{spool}/new/{name}', {'infiles':infiles, 'out':out})
+    print(f'Queued {name} in {spool}')
+
+
+""" Columnar extraction of one task using pooled file handles """
+def run_task(task, pool, chunk_size, cache_dir=None):
+
+    aggs = []
+    options = {'gap_threshold':gap_threshold, 'bin_width':bin_width}
+    for src, infile in enumerate(task['infiles']):
+
+        # Reuse partial aggregates of unchanged files
+        if cache_dir != None:
+            identity = file_identity(infile)
+            agg = load_entry(cache_dir, identity, options)
+            if agg is not None:
+                agg['src'] = src
+                aggs.append(agg)
+                continue
+
+        print(f'Working on {infile}...')
+        agg = merge([])
+        for entry0, mjd, run in pool.get(infile).chunks(chunk_size):
+            agg = merge([agg, aggregate(mjd, run, entry0, src)])
+        aggs.append(agg)
+
+        if cache_dir != None:
+            save_entry(cache_dir, identity, agg, options)
+
+    agg = merge(aggs)
+    np.savetxt(task['out'], summary_lines(agg, mjd2iso), fmt='%s')
+    save_gaps(task['out'], agg)
+    save_counts(task['out'], agg)
+
+
+""" Move tasks left in work/ (by a worker that died) back to new/. Returns
+    the number of tasks queued again """
+def requeue(spool):
+
+    names = [name for name in sorted(os.listdir(f'{spool}/work'))
+            if name.endswith('.json')]
+    for name in names:
+        os.replace(f'{spool}/work/{name}', f'{spool}/new/{name}')
+
+    return len(names)
+
+
+""" Claim and run queued tasks until stopped or idle for too long """
+def serve(spool, pool, chunk_size, cache_dir=None, poll=2, idle=0):
+
+    # Finish the current task on SIGTERM, then shut down cleanly
+    stop = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.append(signum))
+
+    last_task = time.time()
+    while not stop:
+
+        queued = sorted(os.listdir(f'{spool}/new'))
+        queued = [name for name in queued if name.endswith('.json')]
+        if queued == []:
+            if idle > 0 and time.time() - last_task > idle:
+                print(f'No tasks for {idle} s. Exiting...')
+                break
+            time.sleep(poll)
+            continue
+
+        # Renaming is atomic, so several workers can share one spool
+        name = queued[0]
+        work = f'{spool}/work/{name}'
+        try:
+            os.rename(f'{spool}/new/{name}', work)
+        except FileNotFoundError:
+            continue
+
+        # Unreadable tasks are set aside as they are, without stopping the
+        # worker
+        try:
+            with open(work, 'r') as f:
+                task = json.load(f)
+            if not isinstance(task, dict):
+                raise ValueError('Task is not a json object')
+        except (OSError, ValueError):
+            print(f'Task {name} is unreadable:\n{traceback.format_exc()}')
+            os.replace(work, f'{spool}/failed/{name}')
+            last_task = time.time()
+            continue
+
+        t0 = time.time()
+        try:
+            run_task(task, pool, chunk_size, cache_dir)
+        except Exception:
+            task['error'] = traceback.format_exc()
+            print(f'Task {name} failed:\n{task["error"]}')
+            dump_json(f'{spool}/failed/{name}', task)
+        else:
+            task['seconds'] = time.time() - t0
+            print(f'Finished. Information saved to {task["out"]}')
+            dump_json(f'{spool}/done/{name}', task)
+        os.remove(work)
+        last_task = time.time()
+
+
+if __name__ == "__main__":
+
+    p = argparse.ArgumentParser(
+            description='Persistent worker for root_extractor.py tasks ' + \
+            'queued in a spool directory')
+    p.add_argument('-s', '--spool', dest='spool',
+            required=True,
+            help='Spool directory holding new/work/done/failed tasks')
+    p.add_argument('--submit', dest='submit',
+            default=False, action='store_true',
+            help='Queue a task (-i/-o) instead of running a worker')
+    p.add_argument('-i', '--infiles', dest='infiles',
+            nargs='+',
+            help='File(s) to retrieve the information from (with --submit)')
+    p.add_argument('-o', '--out', dest='out',
+            help='Name of output text file to store info (with --submit)')
+    p.add_argument('--backend', dest='backend',
+            default='auto', choices=['auto', 'uproot', 'root'],
+            help='ROOT file reader (auto prefers uproot, falling back to PyROOT)')
+    p.add_argument('--chunk', dest='chunk',
+            type=int, default=1000000,
+            help='Number of tree entries read per chunk')
+    p.add_argument('--cache', dest='cache',
+            default=None,
+            help='Directory of cached per-file aggregates')
+    p.add_argument('--max-open', dest='max_open',
+            type=int, default=16,
+            help='Maximum number of ROOT files kept open between tasks')
+    p.add_argument('--poll', dest='poll',
+            type=float, default=2,
+            help='Seconds between checks for new tasks')
+    p.add_argument('--idle', dest='idle',
+            type=float, default=0,
+            help='Exit after this many seconds without tasks (0 = never)')
+    p.add_argument('--requeue', dest='requeue',
+            default=False, action='store_true',
+            help='Queue tasks left in work/ by a dead worker again before ' + \
+            'starting. Only safe when no other worker is running')
+    args = p.parse_args()
+    if args.max_open < 1:
+        p.error(f'--max-open {args.max_open} must be at least 1')
+
+    for stage in stages:
+        os.makedirs(f'{args.spool}/{stage}', exist_ok=True)
+
+    if args.submit:
+        submit_task(args.spool, [os.path.abspath(f) for f in args.infiles],
+                os.path.abspath(args.out))
+
+    else:
+        if args.requeue:
+            print(f'Queued {requeue(args.spool)} unfinished task(s) again')
+        reader = get_reader(args.backend)
+        print(f'Reading with the {reader.name} backend')
+        pool = HandlePool(reader, args.max_open)
+        try:
+            serve(args.spool, pool, args.chunk, args.cache, args.poll, args.idle)
+        finally:
+            pool.close()
@@ -0,0 +1,213 @@
+########################################################################
+###    SQLite catalog of input files (ROOT DSTs, fits maps, level2   ###
+###    files) with the size, mtime, config, date and run of each.    ###
+###    Paths are parsed once, and a refresh lists a directory again  ###
+###    only when its mtime has changed, so scripts query the catalog ###
+###    instead of globbing over NFS.                                 ###
+########################################################################
+
+
+import sqlite3
+import json
+import os
+import re
+
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Default catalog location
+default_catalog = os.path.expanduser('~/.cache/anisotropy/files.sqlite')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY, dir TEXT, kind TEXT,
+        size INTEGER, mtime INTEGER,
+        config TEXT, date TEXT, run INTEGER);
+CREATE INDEX IF NOT EXISTS files_config_date ON files (kind, config, date);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+        path TEXT PRIMARY KEY, kind TEXT, mtime INTEGER, subdirs TEXT);
+'''
+
+# Config, date and run as they appear in input paths
+cfg_re = re.compile(r'IC86[-.]\d{4}')
+date_re = re.compile(r'\d{4}-\d{2}-\d{2}')
+level2_re = re.compile(r'/(\d{4})/filtered/level2/(\d{2})(\d{2})(/|$)')
+run_re = re.compile(r'Run(\d{8})')
+
+# File name patterns for each kind of input
+root_match = r'\.root$'
+fits_match = r'sid_\d{4}-\d{2}-\d{2}\.fits$'
+level2_match = r'Run\d{8}'
+
+
+""" fits maps sit in IC86-YYYY directories of the map directory """
+def fits_descend(depth, name):
+    return depth == 0 and re.fullmatch(r'IC86-\d{4}', name) != None
+
+""" level2 files sit in MMDD day directories or in their Run######## run
+    directories """
+def level2_descend(depth, name):
+    if depth == 0:
+        return re.fullmatch(r'\d{4}', name) != None
+    return depth == 1 and re.fullmatch(r'Run\d{8}', name) != None
+
+
+""" Config (IC86-YYYY), date (YYYY-MM-DD) and run of a file path, None
+    where the path does not give them """
+def parse_path(path):
+
+    cfg = cfg_re.findall(path)
+    date = date_re.findall(path)
+    run = run_re.findall(path)
+
+    # level2 files are dated by their year and MMDD directories
+    if date == []:
+        m = level2_re.search(path)
+        date = [f'{m[1]}-{m[2]}-{m[3]}'] if m != None else []
+
+    return (cfg[-1].replace('.', '-') if cfg != [] else None,
+            date[-1] if date != [] else None,
+            int(run[-1]) if run != [] else None)
+
+
+""" Open (creating if needed) a catalog database """
+def open_catalog(path=default_catalog):
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.executescript(schema)
+
+    return db
+
+
+""" List one directory unless its mtime equals cached_mtime. Returns
+    (mtime, subdirectories to descend into, matching files as (path, size,
+    mtime)); the last two are None for an unchanged directory, and mtime is
+    None if the directory has gone """
+def list_dir(path, cached_mtime, match, descend, depth, stat):
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == cached_mtime:
+            return mtime, None, None
+
+        subdirs, files = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if descend(depth, entry.name):
+                        subdirs += [entry.name]
+                elif match.search(entry.name):
+                    st = entry.stat() if stat else None
+                    files += [(entry.path, st.st_size if stat else None,
+                            st.st_mtime_ns if stat else None)]
+    except FileNotFoundError:
+        return None, [], []
+
+    return mtime, sorted(subdirs), sorted(files)
+
+
+""" Replace the catalog rows of one listed directory. With unique, only the
+    first file for each (config, date, run) in the directory is kept """
+def store(db, kind, path, mtime, subdirs, files, unique=False):
+
+    rows, keys = [], set()
+    for f, size, f_mtime in files:
+        cfg, date, run = parse_path(f)
+        if unique:
+            if (cfg, date, run) in keys:
+                continue
+            keys.add((cfg, date, run))
+        rows += [(f, path, kind, size, f_mtime, cfg, date, run)]
+
+    db.execute('DELETE FROM files WHERE dir = ?', (path,))
+    db.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?)',
+            rows)
+    db.execute('INSERT OR REPLACE INTO dirs VALUES (?,?,?,?)',
+            (path, kind, mtime, json.dumps(subdirs)))
+
+
+""" Bring the catalog up to date with files of one kind below top whose
+    names match a regex. descend(depth, name) picks the subdirectories to
+    walk (depth 0 is top's children). Each level of directories is listed
+    over a pool of threads; directories with an unchanged mtime are not
+    listed again unless full is set, so files rewritten in place need a
+    full refresh. Returns the number of directories listed """
+def refresh(db, kind, top, match, descend=lambda depth, name: True,
+        stat=True, unique=False, full=False, workers=8):
+
+    match = re.compile(match)
+    top = os.path.abspath(top)
+
+    cached = {}
+    for path, mtime, subdirs in db.execute('SELECT path, mtime, subdirs ' + \
+            'FROM dirs WHERE kind = ? AND (path = ? OR substr(path, 1, ?) = ?)',
+            (kind, top, len(top) + 1, f'{top}/')):
+        cached[path] = (None if full else mtime, json.loads(subdirs))
+
+    seen = set()
+    level = [top]
+    depth = 0
+    nlisted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while level != []:
+
+            mtimes = [cached.get(path, (None,))[0] for path in level]
+            results = executor.map(list_dir, level, mtimes, repeat(match),
+                    repeat(descend), repeat(depth), repeat(stat))
+
+            next_level = []
+            for path, (mtime, subdirs, files) in zip(level, results):
+                if mtime == None:
+                    continue
+                seen.add(path)
+                if files == None:
+                    subdirs = cached[path][1]
+                else:
+                    store(db, kind, path, mtime, subdirs, files, unique)
+                    nlisted += 1
+                next_level += [f'{path}/{name}' for name in subdirs]
+
+            level = next_level
+            depth += 1
+
+    # Forget directories that no longer exist, with their files
+    for path in set(cached) - seen:
+        db.execute('DELETE FROM dirs WHERE path = ?', (path,))
+        db.execute('DELETE FROM files WHERE dir = ?', (path,))
+    db.commit()
+
+    return nlisted
+
+
+""" Catalog rows (path, config, date, run) of one kind, optionally limited
+    to a config, a date and files below top, sorted by path """
+def find(db, kind, config=None, date=None, top=None):
+
+    query = 'SELECT path, config, date, run FROM files WHERE kind = ?'
+    params = [kind]
+    if config != None:
+        query += ' AND config = ?'
+        params += [config]
+    if date != None:
+        query += ' AND date = ?'
+        params += [date]
+    if top != None:
+        top = f'{os.path.abspath(top)}/'
+        query += ' AND substr(path, 1, ?) = ?'
+        params += [len(top), top]
+
+    return db.execute(query + ' ORDER BY path', params).fetchall()
+
+
+""" Date -> sorted list of files of one kind for a config """
+def files_by_date(db, kind, config, top=None):
+
+    dates = {}
+    for path, cfg, date, run in find(db, kind, config, top=top):
+        if date != None:
+            dates.setdefault(date, []).append(path)
+
+    return dict(sorted(dates.items()))
@@ -0,0 +1,145 @@
+########################################################################
+###    Low-allocation event counter for HEALPix fits maps. The map   ###
+###    column of the binary table is memory mapped and summed in     ###
+###    bounded chunks, instead of converting the whole map to a new  ###
+###    float64 array with hp.read_map just to take .sum().           ###
+########################################################################
+
+
+import numpy as np
+import threading
+
+
+block = 2880
+
+# Big-endian fits column types
+tform_dtypes = {'B':'u1', 'I':'>i2', 'J':'>i4', 'K':'>i8', 'E':'>f4', 'D':'>f8'}
+
+
+""" Parse one fits header starting at offset. Returns (cards, data offset) """
+def read_header(f, offset):
+
+    cards = {}
+    f.seek(offset)
+    while True:
+        data = f.read(block)
+        if len(data) < block:
+            raise ValueError('Truncated fits header')
+        offset += block
+        for i in range(0, block, 80):
+            card = data[i:i+80].decode('ascii')
+            key = card[:8].strip()
+            if key == 'END':
+                return cards, offset
+            if card[8:10] != '= ':
+                continue
+            value = card[10:].strip()
+            if value.startswith("'"):
+                value = value[1:value.index("'", 1)].strip()
+            else:
+                value = value.split('/')[0].strip()
+            cards[key] = value
+
+
+""" Size in bytes (padded to whole blocks) of the data following a header """
+def data_size(cards):
+
+    naxis = int(cards.get('NAXIS', 0))
+    if naxis == 0:
+        return 0
+
+    n = 1
+    for i in range(1, naxis + 1):
+        n *= int(cards[f'NAXIS{i}'])
+    n = abs(int(cards['BITPIX'])) // 8 * int(cards.get('GCOUNT', 1)) * \
+            (n + int(cards.get('PCOUNT', 0)))
+
+    return -(-n // block) * block
+
+
+class MapCounter:
+
+    """ chunk: number of pixel values summed at a time """
+    def __init__(self, chunk=1<<20):
+        self.chunk = chunk
+        self.local = threading.local()
+
+    """ Native-endian scratch buffer of at least n values, reused across files.
+        Each thread gets its own buffers, so threads can count at once """
+    def buffer(self, dtype, n):
+        if not hasattr(self.local, 'buffers'):
+            self.local.buffers = {}
+        buffers = self.local.buffers
+        dtype = np.dtype(dtype).newbyteorder('=')
+        if dtype not in buffers or len(buffers[dtype]) < n:
+            buffers[dtype] = np.empty(max(n, self.chunk), dtype=dtype)
+        return buffers[dtype]
+
+    """ Locate the map column: (data offset, rows, row bytes, column bytes,
+        dtype, TSCAL, TZERO) """
+    def layout(self, path):
+
+        with open(path, 'rb') as f:
+            cards, offset = read_header(f, 0)
+            offset += data_size(cards)
+            cards, offset = read_header(f, offset)
+
+        if cards.get('XTENSION') != 'BINTABLE':
+            raise ValueError(f'No binary table in {path}')
+        if cards.get('INDXSCHM', 'IMPLICIT') != 'IMPLICIT':
+            raise ValueError(f'Partial (explicit index) map in {path}')
+
+        # hp.read_map reads the first column by default
+        tform = cards['TFORM1']
+        repeat = int(tform[:-1]) if len(tform) > 1 else 1
+        if tform[-1] not in tform_dtypes:
+            raise ValueError(f'Unsupported column type {tform} in {path}')
+        dtype = np.dtype(tform_dtypes[tform[-1]])
+
+        return (offset, int(cards['NAXIS2']), int(cards['NAXIS1']),
+                repeat*dtype.itemsize, dtype,
+                float(cards.get('TSCAL1', 1)), float(cards.get('TZERO1', 0)))
+
+    """ Total of all pixel values, equal to int(hp.read_map(path).sum()) for
+        integer-valued (counts) maps """
+    def count(self, path):
+
+        offset, nrows, row_bytes, col_bytes, dtype, scale, zero = \
+                self.layout(path)
+        if nrows == 0:
+            return 0
+
+        raw = np.memmap(path, dtype=np.uint8, mode='r', offset=offset,
+                shape=(nrows, row_bytes))
+        repeat = col_bytes // dtype.itemsize
+
+        # Floats sum in float64 like the converted map, integers in int64
+        acc = np.float64 if dtype.kind == 'f' else np.int64
+        rows = max(1, self.chunk // repeat)
+        buf = self.buffer(dtype, rows*repeat)
+        total = acc(0)
+        for i in range(0, nrows, rows):
+            values = raw[i:i+rows, :col_bytes].view(dtype)
+            n = values.size
+            np.copyto(buf[:n].reshape(values.shape), values)
+            total += np.add.reduce(buf[:n], dtype=acc)
+        del values, raw
+
+        if scale != 1 or zero != 0:
+            return int(zero*nrows*repeat + scale*total)
+        return int(total)
+
+
+# Shared counter so every caller in a thread reuses the same buffers
+counter = MapCounter()
+
+
+""" Event count for a fits map, falling back to healpy for layouts the
+    memory-mapped reader does not handle """
+def count_events(path):
+
+    try:
+        return counter.count(path)
+    except (ValueError, KeyError):
+        import healpy as hp
+        return int(hp.read_map(path, verbose=0).sum())
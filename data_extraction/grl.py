@@ -0,0 +1,220 @@
+########################################################################
+###    Good run list loading shared by all scripts. The GRL json is  ###
+###    parsed once into a compact run table, which is cached as a    ###
+###    binary file keyed on the source file's size and mtime.        ###
+########################################################################
+
+
+import numpy as np
+import hashlib
+import json
+import os
+import re
+
+from atomic_io import atomic_open
+
+
+# Default location of parsed good run lists
+cache_dir = os.path.expanduser('~/.cache/anisotropy/grl')
+
+# Start of the runs array, and separators between its entries
+runs_key = re.compile(r'"runs"\s*:\s*\[')
+separator = re.compile(r'[\s,]*')
+
+# One row per GRL entry, in file order. A null good_tstop is NaT
+grl_dtype = np.dtype([
+        ('run', 'i8'), ('good_i3', '?'), ('good_it', '?'),
+        ('tstart', 'M8[us]'), ('tstop', 'M8[us]')])
+
+
+""" Source file identity the cache is keyed on """
+def grl_identity(goodrunfile):
+    st = os.stat(goodrunfile)
+    return {'path': os.path.abspath(goodrunfile), 'size': st.st_size,
+            'mtime': st.st_mtime_ns}
+
+
+""" Cache file for a good run list """
+def cache_path(goodrunfile, cache_dir=cache_dir):
+    key = hashlib.sha1(os.path.abspath(goodrunfile).encode()).hexdigest()
+    return f'{cache_dir}/{key}.npz'
+
+
+""" Yield the entries of the runs array of a good run list one at a time.
+    The file is read in blocks, so only one block and one entry are held in
+    memory however long the list is. Entries longer than max_entry characters
+    are taken to be malformed """
+def iter_runs(goodrunfile, block=1<<20, max_entry=1<<20):
+
+    decoder = json.JSONDecoder()
+    with open(goodrunfile, 'r') as f:
+
+        # Find the start of the runs array
+        buf, match = '', None
+        while match == None:
+            data = f.read(block)
+            if data == '':
+                raise ValueError(f'No runs array in {goodrunfile}')
+            buf += data
+            match = runs_key.search(buf)
+        pos = match.end()
+
+        while True:
+            pos = separator.match(buf, pos).end()
+            if buf[pos:pos+1] == ']':
+                return
+            try:
+                row, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                # An entry still undecodable with more than max_entry
+                # characters of text is malformed, not cut off by the end
+                # of the block
+                if len(buf) - pos > max_entry:
+                    raise ValueError(f'Malformed runs entry in {goodrunfile}' + \
+                            f' ({e})')
+                # Entry runs past the end of the block
+                data = f.read(block)
+                if data == '':
+                    raise ValueError(f'Truncated runs array in {goodrunfile}')
+                buf, pos = buf[pos:] + data, 0
+                continue
+            yield row
+
+
+""" Convert the first n rows of raw block columns into a run table.
+    Timestamps are parsed as a whole column; missing stop times become NaT """
+def convert_block(runs, good, times, n):
+
+    block = np.zeros(n, dtype=grl_dtype)
+    block['run'] = runs[:n]
+    block['good_i3'] = good[:n, 0]
+    block['good_it'] = good[:n, 1]
+    block['tstart'] = times[:n, 0].astype('M8[us]')
+    block['tstop'] = times[:n, 1].astype('M8[us]')
+
+    return block
+
+
+""" Parse a good run list json file into a run table. Entries are collected
+    into preallocated raw columns of size rows, and each full block is
+    converted at once """
+def parse_grl(goodrunfile, size=1<<14):
+
+    grl = np.zeros(size, dtype=grl_dtype)
+    n = 0
+
+    runs = np.zeros(size, dtype=np.int64)
+    good = np.zeros((size, 2), dtype=bool)
+    times = np.zeros((size, 2), dtype='U32')
+    k = 0
+
+    for row in iter_runs(goodrunfile):
+
+        runs[k] = row['run']
+        good[k] = (row['good_i3'], row['good_it'])
+        tstop = row['good_tstop'] if row['good_tstop'] != None else 'NaT'
+        times[k] = (row['good_tstart'], tstop)
+        k += 1
+        if k < size:
+            continue
+
+        # Double the columns when full
+        if n + k > len(grl):
+            grl = np.concatenate([grl, np.zeros(len(grl), dtype=grl_dtype)])
+        grl[n:n+k] = convert_block(runs, good, times, k)
+        n += k
+        k = 0
+
+    return np.concatenate([grl[:n], convert_block(runs, good, times, k)])
+
+
+""" Rows of a run table that start on days in [t_start, t_end) """
+def select(grl, t_start=None, t_end=None):
+
+    day = start_days(grl)
+    keep = np.ones(len(grl), dtype=bool)
+    if t_start != None:
+        keep &= day >= t_start
+    if t_end != None:
+        keep &= day < t_end
+
+    return grl[keep]
+
+
+""" Run table for a good run list, reduced to start days in [t_start, t_end).
+    The full table is cached and reused while the file is unchanged. With no
+    cache_dir the file is parsed every time """
+def load_grl(goodrunfile, t_start=None, t_end=None, cache_dir=cache_dir):
+
+    if cache_dir == None:
+        return select(parse_grl(goodrunfile), t_start, t_end)
+
+    identity = grl_identity(goodrunfile)
+    cache = cache_path(goodrunfile, cache_dir)
+
+    if os.path.isfile(cache):
+        try:
+            with np.load(cache) as npz:
+                if json.loads(str(npz['identity'])) == identity:
+                    return select(npz['grl'], t_start, t_end)
+        except (OSError, ValueError, KeyError):
+            print(f'Warning: unreadable good run list cache {cache}, ignoring')
+
+    grl = parse_grl(goodrunfile)
+
+    # Caching is an optimization; an unwritable cache is not an error
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with atomic_open(cache, 'wb') as f:
+            np.savez(f, grl=grl, identity=np.array(json.dumps(identity)))
+    except OSError as e:
+        print(f'Warning: unable to cache good run list ({e})')
+
+    return select(grl, t_start, t_end)
+
+
+""" Sorted run numbers marked bad by i3 (and optionally by IceTop) """
+def bad_runs(grl, icetop=False):
+
+    bad = ~grl['good_i3']
+    if icetop:
+        bad |= ~grl['good_it']
+
+    return np.unique(grl['run'][bad])
+
+
+""" Start day of every run as an int, e.g. 20150513 """
+def start_days(grl):
+    day = grl['tstart'].astype('M8[D]')
+    month = day.astype('M8[M]')
+    yy = month.astype('M8[Y]').astype(np.int64) + 1970
+    mm = month.astype(np.int64) % 12 + 1
+    dd = (day - month).astype(np.int64) + 1
+    return yy*10000 + mm*100 + dd
+
+
+""" Split every run at each midnight it crosses. Returns, per piece, the
+    GRL row, the day (days since 1970-01-01) and the livetime in whole
+    seconds. Runs with no stop time give one NaN piece on their start day """
+def split_days(grl):
+
+    # Fractions of seconds are dropped, as in the summaries
+    start = grl['tstart'].astype('M8[s]').astype(np.int64)
+    null = np.isnat(grl['tstop'])
+    stop = np.where(null, start, grl['tstop'].astype('M8[s]').astype(np.int64))
+
+    # Runs ending exactly at midnight also get a zero-length piece on the
+    # next day
+    first = start // 86400
+    ndays = np.maximum(stop // 86400 - first + 1, 1)
+
+    row = np.repeat(np.arange(len(grl)), ndays)
+    offset = np.arange(len(row)) - np.repeat(np.cumsum(ndays) - ndays, ndays)
+    day = first[row] + offset
+
+    lo = np.maximum(start[row], day*86400)
+    hi = np.minimum(stop[row], (day + 1)*86400)
+    livetime = np.maximum(hi - lo, 0).astype(np.float64)
+    livetime[null[row]] = np.nan
+
+    return row, day, livetime
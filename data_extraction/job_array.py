@@ -0,0 +1,65 @@
+########################################################################
+###    HTCondor job-array submission for the submitters. One submit  ###
+###    description queues every job of a plan; each task gets its    ###
+###    arguments from one line of an argument manifest.              ###
+########################################################################
+
+
+import getpass
+import os
+import subprocess
+
+
+# Default location for submit files and logs
+submit_prefix = f'/scratch/{getpass.getuser()}'
+
+
+""" Write the wrapper script that runs the command in the requested
+    environment, with the task arguments appended """
+def write_wrapper(submit_dir, name, cmd, header):
+
+    os.makedirs(f'{submit_dir}/logs', exist_ok=True)
+
+    executable = f'{submit_dir}/{name}.sh'
+    with open(executable, 'w') as f:
+        f.write('\n'.join(header + [f'{cmd} "$@"']) + '\n')
+    os.chmod(executable, 0o755)
+
+    return executable
+
+
+""" Write the wrapper script, argument manifest and submit description """
+def write_array(submit_dir, name, cmd, arglines, header, sublines):
+
+    log_dir = f'{submit_dir}/logs'
+    executable = write_wrapper(submit_dir, name, cmd, header)
+
+    # One line of arguments per task
+    argfile = f'{submit_dir}/{name}_args.txt'
+    with open(argfile, 'w') as f:
+        f.writelines([f'{line}\n' for line in arglines])
+
+    submit = f'{submit_dir}/{name}.sub'
+    lines = ['universe = vanilla',
+            f'executable = {executable}',
+            'arguments = $(task_args)',
+            f'log = {log_dir}/{name}.log',
+            f'output = {log_dir}/{name}_$(Process).out',
+            f'error = {log_dir}/{name}_$(Process).err']
+    lines += sublines
+    lines += [f'queue task_args from {argfile}']
+    with open(submit, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    return submit
+
+
+""" Submit a job array, or only report the files when dry_run is set """
+def submit_array(submit, ntasks, dry_run=False):
+
+    if dry_run:
+        print(f'Dry run: {ntasks} task(s) described in {submit}')
+        return
+
+    subprocess.run(['condor_submit', submit], check=True)
+    print(f'Submitted {ntasks} task(s) from {submit}')
@@ -0,0 +1,94 @@
+########################################################################
+###    Job planning for the cluster submitters. Dates are packed     ###
+###    into jobs of roughly equal input size (bytes or tree          ###
+###    entries) and the plan is written to a json manifest that      ###
+###    root_extractor.py / day_run_num_24H.py read directly.         ###
+########################################################################
+
+
+import json
+import time
+import os
+
+from atomic_io import dump_json
+
+
+# Default processing speed of a single job, per unit of weight
+throughputs = {'bytes': 20e6, 'entries': 1e6}
+
+
+""" New plan file for a config in plan_dir. The name carries the submission
+    time and process, so a resubmit never replaces the plan that jobs
+    queued earlier still index into """
+def plan_path(plan_dir, config):
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return f'{plan_dir}/plan_{config}_{stamp}_{os.getpid()}.json'
+
+
+""" Size of a list of files in bytes or CutDST entries """
+def task_weight(infiles, balance='bytes', backend='auto'):
+
+    if balance == 'bytes':
+        return sum([os.path.getsize(f) for f in infiles])
+
+    from dst_readers import get_reader
+    reader = get_reader(backend)
+    weight = 0
+    for f in infiles:
+        with reader(f) as r:
+            weight += r.num_entries()
+
+    return weight
+
+
+""" First-fit decreasing packing of tasks into jobs of a target weight """
+def pack_tasks(tasks, capacity):
+
+    jobs = []
+    for task in sorted(tasks, key=lambda task: task['weight'], reverse=True):
+
+        # Oversized tasks simply get a job of their own
+        for job in jobs:
+            if job['weight'] + task['weight'] <= capacity:
+                break
+        else:
+            job = {'weight':0, 'tasks':[]}
+            jobs.append(job)
+
+        job['tasks'].append(task)
+        job['weight'] += task['weight']
+
+    # Keep dates in order inside each job for readable logs
+    for job in jobs:
+        job['tasks'].sort(key=lambda task: task['date'])
+
+    return jobs
+
+
+""" Pack tasks into jobs lasting about target_minutes and save the plan """
+def write_plan(outfile, tasks, balance='bytes', target_minutes=60,
+        throughput=None):
+
+    if throughput == None:
+        throughput = throughputs[balance]
+    capacity = target_minutes * 60 * throughput
+    jobs = pack_tasks(tasks, capacity)
+
+    # Written atomically, as running jobs may be reading the old plan
+    plan = {'balance':balance, 'capacity':capacity, 'jobs':jobs}
+    dump_json(outfile, plan, indent=1)
+
+    total = sum([task['weight'] for task in tasks])
+    print(f'Planned {len(tasks)} date(s) into {len(jobs)} job(s) ' + \
+            f'({total:.3g} {balance} total)')
+
+    return jobs
+
+
+""" Tasks (infiles, out) assigned to one job of a saved plan """
+def load_job(manifest, job):
+
+    with open(manifest, 'r') as f:
+        plan = json.load(f)
+
+    return plan['jobs'][job]['tasks']
@@ -2,7 +2,8 @@
 
 import argparse
 import numpy as np
-from datetime import datetime
+
+from grl import load_grl
 
 if __name__ == "__main__":
 
@@ -20,13 +21,10 @@ if __name__ == "__main__":
 
     prefix = '/data/user/eschmidt/stability'
 
-    # open I3 good run list 
+    # load I3 good run list
     file = f'{prefix}/goodrunlist/goodrunslist.txt'
-    f = open(file, "r")
-
-    # read data and separate each entry with keyword 'good_tstart'
-    data = f.readlines()
-    check = sorted([ct for ct, d in enumerate(data) if 'good_tstart' in d])
+    grl = load_grl(file)
+    days = grl['tstart'].astype('M8[D]').astype(str)
 
     # run through each configuration
     for c in args.config:
@@ -35,28 +33,27 @@ if __name__ == "__main__":
         c_info = c_rate.readlines()
         info = [c[:10] for c in c_info]
 
-        # determine necessary lines for the current configuration
-        c_check = sorted([d for d in check if data[d][27:37] in info])
+        # determine necessary runs for the current configuration
+        c_check = np.flatnonzero(np.isin(days, info))
        
         livetime = []
-        # run through the configuration's lines
+        # run through the configuration's runs
         for r in c_check:
+            day = days[r]
+            run = grl['run'][r]
             # check if the run has a null time    
-            if data[r+1][25:29] == 'null':
+            if np.isnat(grl['tstop'][r]):
                 livetime.append(f'{day} - {run} - null')
                 continue
             # obtain start/stop times from list
-            start_t = datetime.strptime(data[r][29:46], '%y-%m-%d %H:%M:%S')
-            stop_t = datetime.strptime(data[r+1][28:45], '%y-%m-%d %H:%M:%S')
+            start_t = grl['tstart'][r].astype('M8[s]').item()
+            stop_t = grl['tstop'][r].astype('M8[s]').item()
 
             # calculate livetime for each run in standard time and seconds
             run_time = str(stop_t - start_t)
             run_sec = (stop_t - start_t).seconds
-            day = data[r][27:37]
-            run = data[r+4][18:24]
             # save information in list
             livetime.append(f'{day} - {run} - {run_time} - {run_sec}')
 
         # save text file with information
         np.savetxt(f'{prefix}/run_time/runt_{c}.txt', livetime, fmt='%s')  
-    f.close()
\ No newline at end of file
@@ -0,0 +1,105 @@
+########################################################################
+###    Interval index over the good run list. For each detector      ###
+###    configuration the good run intervals and the total (run start ###
+###    to next run start) intervals are merged, sorted and prefix    ###
+###    summed, so the livetime in any time window is two binary      ###
+###    searches, for one window or many at once.                     ###
+########################################################################
+
+
+import numpy as np
+
+
+""" Epoch seconds for datetime64 values or date/time strings """
+def to_seconds(t):
+    return np.asarray(t, dtype='M8[s]').astype(np.int64)
+
+
+""" Merge intervals into sorted disjoint (starts, stops, prefix) where
+    prefix[k] is the summed length of the first k intervals """
+def make_intervals(start, stop):
+
+    order = np.argsort(start, kind='stable')
+    start = start[order]
+    stop = np.maximum(stop[order], start)
+    if len(start) == 0:
+        return start, stop, np.zeros(1, dtype=np.int64)
+
+    # A new interval begins wherever a run starts after all earlier ones end
+    new = np.ones(len(start), dtype=bool)
+    new[1:] = start[1:] > np.maximum.accumulate(stop)[:-1]
+    idx = np.flatnonzero(new)
+
+    starts = start[idx]
+    stops = np.maximum.reduceat(stop, idx)
+    prefix = np.append(0, np.cumsum(stops - starts))
+
+    return starts, stops, prefix
+
+
+""" Length of intervals covered before each time t """
+def covered(intervals, t):
+
+    starts, stops, prefix = intervals
+    if len(starts) == 0:
+        return np.zeros(np.shape(t), dtype=np.int64)
+
+    # Whole intervals starting at or before t, less the part after t of the
+    # last of them
+    k = np.searchsorted(starts, t, side='right')
+    after = np.maximum(stops[np.maximum(k - 1, 0)] - t, 0)
+
+    return prefix[k] - np.where(k > 0, after, 0)
+
+
+class LivetimeIndex:
+
+    """ grl: good run table from grl.load_grl, cfgs: config code of each
+        row, negative for runs outside every config """
+    def __init__(self, grl, cfgs):
+
+        cfgs = np.asarray(cfgs)
+        order = np.argsort(grl['tstart'], kind='stable')
+        grl, cfgs = grl[order], cfgs[order]
+
+        start = to_seconds(grl['tstart'])
+        null = np.isnat(grl['tstop'])
+        stop = np.where(null, start, to_seconds(grl['tstop']))
+        good = grl['good_i3'] & ~null
+
+        # Total livetime counts each run until the next one starts, so the
+        # last run in the list adds none
+        next_start = np.append(start[1:], start[-1:])
+
+        self.good = {}
+        self.total = {}
+        for code in np.unique(cfgs[cfgs >= 0]):
+            run = cfgs == code
+            self.good[code] = make_intervals(start[run & good],
+                    stop[run & good])
+            self.total[code] = make_intervals(start[run], next_start[run])
+
+    """ Config codes in the index """
+    def configs(self):
+        return sorted(self.total)
+
+    """ Good livetime (seconds) of a config in windows [t0, t1) """
+    def good_livetime(self, cfg, t0, t1):
+        t0, t1 = to_seconds(t0), to_seconds(t1)
+        return covered(self.good[cfg], t1) - covered(self.good[cfg], t0)
+
+    """ Total livetime (seconds) of a config in windows [t0, t1) """
+    def total_livetime(self, cfg, t0, t1):
+        t0, t1 = to_seconds(t0), to_seconds(t1)
+        return covered(self.total[cfg], t1) - covered(self.total[cfg], t0)
+
+    """ Good and total livetime and the good fraction in windows [t0, t1).
+        Windows with no total livetime have a NaN fraction """
+    def query(self, cfg, t0, t1):
+
+        good = self.good_livetime(cfg, t0, t1)
+        total = self.total_livetime(cfg, t0, t1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = good / total
+
+        return good, total, fraction
@@ -9,15 +9,77 @@
 
 import numpy as np
 import re, os
+import argparse
 import json
-import healpy as hp
-from datetime import datetime as dt
 from glob import glob
-from pathlib import Path
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from atomic_io import atomic_open, dump_json
+from fits_counts import count_events
+from grl import load_grl, bad_runs, split_days
+from run_map import load_map, lookup_cfg
+from file_catalog import default_catalog, open_catalog, refresh, find, \
+        fits_match, fits_descend
+from run_table import run_dtype, day_dtype, cfg_code, day_code, day_name, \
+        make_table, sort_table, sum_duplicates, keep_last, lookup, gather, \
+        day_groups, load_summary
+
+
+# Relative differences between root and i3/fits beyond which a day is flagged
+rate_tol = 0.05
+livetime_tol = 0.01
+count_tol = 0.01
+
+# One row per (cfg, day) in the root files, with its rows [lo, hi) in the
+# root run table
+recon_dtype = np.dtype([
+        ('cfg', 'i2'), ('day', 'i4'), ('lo', 'i8'), ('hi', 'i8'),
+        ('n_root', 'i8'), ('t_root', 'f8'), ('n_fits', 'i8'), ('t_i3', 'f8'),
+        ('has_fits', '?'), ('has_i3', '?'),
+        ('rate_root', 'f8'), ('rate_fits', 'f8'),
+        ('d_livetime', 'f8'), ('d_count', 'i8'),
+        ('flag_rate', '?'), ('flag_livetime', '?'), ('flag_count', '?')])
+
+# One row per run in the root run table
+recon_run_dtype = np.dtype([('t_i3', 'f8'), ('has_i3', '?'), ('bad', '?')])
 
 
 def main():
 
+    p = argparse.ArgumentParser(
+            description='Summarizes root, fits and i3live rates for every run')
+    p.add_argument('--workers', dest='workers',
+            type=int, default=1,
+            help='Number of parallel readers for fits maps')
+    p.add_argument('--pool', dest='pool',
+            default='process', choices=['process', 'thread'],
+            help='Use a process or thread pool for reading fits maps')
+    p.add_argument('--hash', dest='hash',
+            default=False, action='store_true',
+            help='Also compare a hash of the start and end of each fits ' + \
+            'map when deciding whether it changed')
+    p.add_argument('--checkpoint', dest='checkpoint',
+            type=float, default=60,
+            help='Seconds between saves of partial fits map counts')
+    p.add_argument('--rate-tol', dest='rate_tol',
+            type=float, default=rate_tol,
+            help='Flag days whose root and fits rates differ by more ' + \
+            'than this fraction')
+    p.add_argument('--livetime-tol', dest='livetime_tol',
+            type=float, default=livetime_tol,
+            help='Flag days whose root and i3 livetimes differ by more ' + \
+            'than this fraction')
+    p.add_argument('--count-tol', dest='count_tol',
+            type=float, default=count_tol,
+            help='Flag days whose root and fits event counts differ by ' + \
+            'more than this fraction')
+    p.add_argument('--catalog', dest='catalog',
+            default=default_catalog,
+            help='File catalog database, refreshed for the maps before use')
+    args = p.parse_args()
+
     # Run over all detector configurations by default
     configs = [f'IC86-{yy}' for yy in range(2011,2023)]
 
@@ -27,33 +89,42 @@ def main():
     map_dir = '/data/user/fmcnally/anisotropy/maps'
     out_dir = '/data/user/zhardnett/stability'
 
-    # Run to detector config dictionary
-    with open(f'{stability}/run2cfg.json', 'r') as f:
-        run2cfg = json.load(f)
+    # Run to detector config map
+    run_ranges = load_map(f'{stability}/run2cfg.json')
 
     # Extract detector livetime and bad runs from good run list
     print('Loading livetimes from i3live...')
     goodrunfile = '/home/zhardnett/goodrunslist.txt'
-    i3_livetime = get_livetime(goodrunfile, run2cfg)
-    badruns = get_bad_runs(goodrunfile)
+    grl = load_grl(goodrunfile)
+    i3_runs = get_livetime(grl, run_ranges)
+    badruns = bad_runs(grl)
 
     # Load map counts for all detector configurations
     print('Loading fits data...')
-    fits_data = fits_scanner(map_dir, stability)
+    fits_days = fits_scanner(map_dir, stability, args.workers, args.pool,
+            args.hash, args.checkpoint, args.catalog)
 
     # Load counts and livetimes from root files
     print('Loading root data...')
-    root_data = root_scanner(stability)
+    root_runs = root_scanner(stability)
+
+    # Join root, i3 and fits data for every day at once
+    days, runs = reconcile(root_runs, i3_runs, fits_days, badruns,
+            args.rate_tol, args.livetime_tol, args.count_tol)
 
     # String formatting for day and run output
     def day_formatter(t, n, root_fits):
         return f'\t{root_fits:<7} - {t:<7} - {n:<11} - {n/t:.2f}'
 
     h = f'\trun     - {"t (i3)":<7} - {"t (root)":<7} - {"nEvents":<10} - rate'
-    def run_formatter(run, t_i3, t, n):
-        gb = 'b' if run in badruns else 'g'
+    def run_formatter(run, bad, t_i3, t, n):
+        gb = 'b' if bad else 'g'
         return f'\t{run}{gb} - {t_i3:<7} - {t:<7} - {n:<11} - {n/t:.2f}'
 
+    # Livetimes are stored as floats; print whole seconds as integers
+    def seconds(t):
+        return int(t) if np.isfinite(t) else float(t)
+
 
     # Save rates from root and fits files
     rates = {'root':{c:{} for c in configs}, 'fits':{c:{} for c in configs}}
@@ -64,243 +135,313 @@ def main():
         # Store rates and dates for rate check, cfg_info for output
         cfg_info = []
 
+        # Days are sorted by config, so each one is a contiguous block
+        code = cfg_code(cfg)
+        lo, hi = np.searchsorted(days['cfg'], [code, code+1])
+
         # Run through every day present in root files
-        for day, runs in root_data[cfg].items():
+        for d in days[lo:hi]:
+
+            day = day_name(d['day'])
 
             # Note if element doesn't have fits data
-            if day not in fits_data[cfg].keys():
+            if not d['has_fits']:
                 print(f'Warning: {day} ({cfg}) has no fits files!')
                 continue
 
             # Root summary for the day
             cfg_info += [f'\n{day}']
-            t_root = sum([run['livetime'] for r, run in runs.items()])
-            n_root = sum([run['nEvents'] for r, run in runs.items()])
-            cfg_info += [day_formatter(t_root, n_root, 'root')]
-            rates['root'][cfg][day] = n_root/t_root
+            cfg_info += [day_formatter(seconds(d['t_root']), int(d['n_root']),
+                    'root')]
+            rates['root'][cfg][day] = float(d['rate_root'])
 
             # NOTE: Looks like runs are grouped strangely in /data/ana
             # DST root files? e.g., 2022-05-14 in IC86-2022
             # Follow up with JCDV
-            if day not in i3_livetime[cfg].keys():
+            if not d['has_i3']:
                 print(f'Skipping {day} in {cfg}')
                 continue
 
             # Fits/i3 summary for the day
-            t_i3 = sum([t_run for r, t_run in i3_livetime[cfg][day].items()
-                    if r not in badruns]) 
-            n_fits = fits_data[cfg][day]
-            cfg_info += [day_formatter(t_i3, n_fits, 'fits')]
-            rates['fits'][cfg][day] = n_fits/t_i3
+            cfg_info += [day_formatter(seconds(d['t_i3']), int(d['n_fits']),
+                    'fits')]
+            rates['fits'][cfg][day] = float(d['rate_fits'])
 
             # Individual run summaries
             cfg_info += [h]
-            for run, info in runs.items():
+            for info, r in zip(root_runs[d['lo']:d['hi']],
+                    runs[d['lo']:d['hi']]):
 
                 # Note if run is not in root files
-                try: t_i3 = i3_livetime[cfg][day][run]
-                except KeyError:
-                    t_i3 = 'N/A'
+                t_i3 = seconds(r['t_i3']) if r['has_i3'] else 'N/A'
+                cfg_info += [run_formatter(int(info['run']), r['bad'], t_i3,
+                        seconds(info['livetime']), int(info['nEvents']))]
 
-                t_root = info['livetime']
-                n_root = info['nEvents']
-                cfg_info += [run_formatter(run, t_i3, t_root, n_root)]
+        # Report days outside tolerance
+        flagged = days[lo:hi]
+        flagged = flagged['flag_rate'] | flagged['flag_livetime'] | \
+                flagged['flag_count']
+        if flagged.any():
+            print(f'{flagged.sum()} day(s) in {cfg} outside tolerance')
 
         # Save text in summary text file
         out = f'{out_dir}/{cfg}_summary.txt'
-        np.savetxt(out, cfg_info, fmt='%s')
+        with atomic_open(out, 'w') as f:
+            np.savetxt(f, cfg_info, fmt='%s')
 
 
     # Save rate information
     out = f'{out_dir}/rates.json'
-    with open(out, 'w') as f:
-        json.dump(rates, f)
-
-    print(f'Finished! Summary output saved to {out_dir}')
-
-
-""" Extract livetimes from good run file """
-def get_livetime(goodrunfile, run2cfg):
-
-    i3_livetime = {}
-
-    # Load I3 good run list from json file
-    with open(goodrunfile, 'r') as f:
-        i3_data = json.load(f)
-        i3_data = i3_data['runs']
-
-    for run_info in i3_data:
-
-        # Instate each day as a key for the dictionary
-        day = run_info['good_tstart'].split(' ')[0]
-        run = run_info['run']
-
-        # Ignore runs that are before/after the dates of the run dictionary
-        try: cfg = run2cfg[str(run)]
-        except KeyError:
-            continue
-
-        if cfg not in i3_livetime.keys():
-            i3_livetime[cfg] = {}
-        if day not in i3_livetime[cfg].keys():
-            i3_livetime[cfg][day] = {}
-
-        # Deal with null livetimes
-        if run_info['good_tstop'] == None:
-            #i3_livetime[cfg][day][run] = 'null'
-            i3_livetime[cfg][day][run] = np.nan
-            continue
-
-        # Obtain start/stop times from list, removing fractions of seconds
-        t_i = run_info['good_tstart'].split('.')[0]
-        start_t = dt.strptime(t_i, '%Y-%m-%d %H:%M:%S')
-        t_f = run_info['good_tstop'].split('.')[0]
-        stop_t = dt.strptime(t_f, '%Y-%m-%d %H:%M:%S')
-
-        # Check if run crosses over a day and adjust start/stop times
-        if start_t.day != stop_t.day:
-            day_aft = stop_t.strftime('%Y-%m-%d')
-            if day_aft not in i3_livetime[cfg].keys():
-                i3_livetime[cfg][day_aft] = {}
-            midnight = dt.combine(stop_t, dt.min.time())
-            i3_livetime[cfg][day][run] = (midnight - start_t).seconds
-            i3_livetime[cfg][day_aft][run] = (stop_t - midnight).seconds
-
-        # If no crossover, the run is fully contained in a day
-        else:
-            i3_livetime[cfg][day][run] = (stop_t - start_t).seconds
-
-    return i3_livetime
-
-
-""" Extract bad runs from good run file """
-def get_bad_runs(goodrunfile):
-
-    badruns = []
+    dump_json(out, rates)
 
-    # Load I3 good run list from json file
-    with open(goodrunfile, 'r') as f:
-        i3_data = json.load(f)
-        i3_data = i3_data['runs']
+    # Save the full day-by-day reconciliation
+    out = f'{out_dir}/reconcile.npz'
+    with atomic_open(out, 'wb') as f:
+        np.savez(f, days=days, runs=runs, run_table=root_runs,
+                rate_tol=args.rate_tol, livetime_tol=args.livetime_tol,
+                count_tol=args.count_tol)
 
-    for run_info in i3_data:
-        if run_info['good_i3'] == False:
-            badruns.append(run_info['run'])
-
-    return sorted(set(badruns))
+    print(f'Finished! Summary output saved to {out_dir}')
 
 
-""" Checks modified times from a file list against the last update"""
-def is_modified(filelist, storage, update=False):
+""" Join root runs with i3 livetimes and fits counts over (cfg, day, run).
+    Returns a recon_dtype row per root day and a recon_run_dtype row per
+    root run """
+def reconcile(root_runs, i3_runs, fits_days, badruns, rate_tol=rate_tol,
+        livetime_tol=livetime_tol, count_tol=count_tol):
+
+    # Root totals per day
+    lo, hi = day_groups(root_runs)
+    days = np.zeros(len(lo), dtype=recon_dtype)
+    days['cfg'] = root_runs['cfg'][lo]
+    days['day'] = root_runs['day'][lo]
+    days['lo'], days['hi'] = lo, hi
+    if len(lo) != 0:
+        days['n_root'] = np.add.reduceat(root_runs['nEvents'], lo)
+        days['t_root'] = np.add.reduceat(root_runs['livetime'], lo)
+
+    # Fits counts per day
+    i_fits = lookup(fits_days, days['cfg'], days['day'])
+    days['has_fits'] = i_fits >= 0
+    days['n_fits'] = gather(fits_days['nEvents'], i_fits)
+
+    # i3 livetime of good runs per day. A null livetime on a good run makes
+    # the whole day NaN
+    bad = np.isin(i3_runs['run'], badruns)
+    i3_lo, _ = day_groups(i3_runs)
+    i3_days = np.zeros(len(i3_lo), dtype=day_dtype)
+    i3_days['cfg'] = i3_runs['cfg'][i3_lo]
+    i3_days['day'] = i3_runs['day'][i3_lo]
+    if len(i3_lo) != 0:
+        i3_days['livetime'] = np.add.reduceat(
+                np.where(bad, 0, i3_runs['livetime']), i3_lo)
+    i_i3 = lookup(i3_days, days['cfg'], days['day'])
+    days['has_i3'] = i_i3 >= 0
+    days['t_i3'] = gather(i3_days['livetime'], i_i3)
+
+    # Rates, deltas and flags. NaN or infinite values are always flagged
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days['rate_root'] = days['n_root'] / days['t_root']
+        days['rate_fits'] = days['n_fits'] / days['t_i3']
+        days['d_livetime'] = days['t_root'] - days['t_i3']
+        days['d_count'] = days['n_root'] - days['n_fits']
+        both = days['has_fits'] & days['has_i3']
+        days['flag_rate'] = both & ~(np.abs(days['rate_root'] - \
+                days['rate_fits']) <= rate_tol*days['rate_fits'])
+        days['flag_livetime'] = days['has_i3'] & ~(np.abs(
+                days['d_livetime']) <= livetime_tol*days['t_i3'])
+        days['flag_count'] = both & ~(np.abs(days['d_count']) <= \
+                count_tol*days['n_fits'])
+
+    # i3 livetime and good/bad status of every root run
+    runs = np.zeros(len(root_runs), dtype=recon_run_dtype)
+    i_run = lookup(i3_runs, root_runs['cfg'], root_runs['day'],
+            root_runs['run'])
+    runs['has_i3'] = i_run >= 0
+    runs['t_i3'] = gather(i3_runs['livetime'], i_run, np.nan)
+    runs['bad'] = np.isin(root_runs['run'], badruns)
+
+    return days, runs
+
+
+""" Extract livetimes from the good run table as a run table """
+def get_livetime(grl, run_ranges):
+
+    # Ignore runs that are before/after the dates of the run map
+    cfgs = lookup_cfg(run_ranges, grl['run'])
+
+    # Livetime of each run on every day it covers
+    row, day, livetime = split_days(grl)
+    keep = cfgs[row] >= 0
+    row, day, livetime = row[keep], day[keep], livetime[keep]
+
+    # Later entries for the same run and day replace earlier ones
+    i3_runs = make_table(run_dtype, cfg=cfgs[row], day=day,
+            run=grl['run'][row], livetime=livetime)
+
+    return keep_last(i3_runs)
+
+
+""" Size and mtime of a file, plus a hash of its first and last 64 kB """
+def file_stamp(path, use_hash=False, nbytes=65536):
+
+    st = os.stat(path)
+    stamp = {'size':st.st_size, 'mtime':st.st_mtime_ns}
+
+    if use_hash:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            h.update(f.read(nbytes))
+            f.seek(max(0, st.st_size - nbytes))
+            h.update(f.read(nbytes))
+        stamp['hash'] = h.hexdigest()
+
+    return stamp
+
+
+""" Event count for one fits map. Errors are returned, not raised, so one
+    bad map does not stop the others """
+def count_map(fits):
+
+    try:
+        n = count_events(fits)
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+    return n, None
+
+
+""" Count events in a list of fits maps, optionally over a pool of workers.
+    Yields (file, count, error) in input order as results come in """
+def iter_counts(fits_files, workers=1, pool='process'):
+
+    if workers <= 1:
+        executor = None
+        results = map(count_map, fits_files)
+    else:
+        Executor = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+        executor = Executor(max_workers=workers)
+        results = executor.map(count_map, fits_files)
+
+    try:
+        nfiles = len(fits_files)
+        for i, (fits, (n, error)) in enumerate(zip(fits_files, results)):
+            print(f'Reading file {i+1} of {nfiles}...', end='\r')
+            if error != None:
+                print(f'\nWarning: unable to read {fits} ({error})')
+            yield fits, n, error
+        print()
+    finally:
+        if executor != None:
+            executor.shutdown(cancel_futures=True)
 
-    filelist.sort()
-    mtimes = []
-    for f in filelist:
-        path = Path(f)
-        mtimes += [f'{f} : {path.stat().st_mtime}\n']
 
-    if not os.path.isfile(storage):
-        print(f'File {storage} not found! Creating...')
-        with open(storage, 'w') as f:
-            f.writelines(mtimes)
-        return True
+""" Date -> count for every recorded map, in file order """
+def map_counts(cfg_files, entries, dates):
 
-    if update:
-        with open(storage, 'w') as f:
-            f.writelines(mtimes)
-        return False
+    cfg_data = {}
+    for fits in cfg_files:
+        if fits in entries:
+            cfg_data[dates[fits]] = entries[fits]['count']
 
-    with open(storage, 'r') as f:
-        old_mtimes = f.readlines()
-        if old_mtimes != mtimes:
-            return True
+    return cfg_data
 
-    return False
 
+def fits_scanner(map_dir, summary_dir, workers=1, pool='process',
+        use_hash=False, checkpoint=60, catalog=default_catalog):
 
-def fits_scanner(map_dir, summary_dir):
+    # Find nEvents for each day, with maps listed by the file catalog
+    db = open_catalog(catalog)
+    refresh(db, 'fits', map_dir, fits_match, fits_descend)
+    fits_files = find(db, 'fits', top=map_dir)
+    dates = {f:date for f, cfg, date, run in fits_files}
+    configs = sorted(set([cfg for f, cfg, date, run in fits_files]))
 
-    # Find nEvents for each day
-    fits_files = sorted(glob(f'{map_dir}/IC86-????/*sid_????-??-??.fits'))
-    configs = sorted(set([re.findall('IC86-\d{4}', f)[0] for f in fits_files]))
+    cfgs, days, counts = [], [], []
 
     # Run through each configuration
     for cfg in configs:
 
         # Retrieve fits files
-        fits_data = {}
-        cfg_files = [f for f in fits_files if cfg in f]
-
-        # Update summary dictionaries and modified times if needed
-        mod_file = f'{summary_dir}/mtimes_{cfg}.txt'
-        if is_modified(cfg_files, mod_file):
-
-            # Run through each fits file
-            print(f'Map summary file for {cfg} is out of date! Updating...')
-            for fits in cfg_files:
-
-                # Read fits file
-                map_i = hp.read_map(fits, verbose=0)
-                date = re.split('_|\.', fits)[-2]
-
-                # Save information in dictionary
-                fits_data[date] = int(map_i.sum())
-
-            outfile = f'{summary_dir}/mapcounts_{cfg}.json'
-            with open(outfile, 'w') as f:
-                json.dump(fits_data, f)
-
-            # Update modified times
-            is_modified(cfg_files, mod_file, update=True)
-
-    fits_data = {}
-    for cfg in configs:
-        with open(f'{summary_dir}/mapcounts_{cfg}.json', 'r') as f:
-            fits_data[cfg] = json.load(f)
-
-    return fits_data
-
-
-
+        cfg_files = [f for f, c, date, run in
+                find(db, 'fits', cfg, top=map_dir)]
+
+        # Per-file record of size, mtime (and hash) with each map's count.
+        # This is the checkpoint: maps recorded here are not read again
+        mod_file = f'{summary_dir}/mtimes_{cfg}.json'
+        manifest = {}
+        if os.path.isfile(mod_file):
+            with open(mod_file, 'r') as f:
+                manifest = json.load(f)
+
+        # Keep counts of unchanged maps, note new or modified ones
+        entries, stale = {}, []
+        for fits in cfg_files:
+            stamp = file_stamp(fits, use_hash)
+            old = manifest.get(fits, {})
+            if all([old.get(k) == v for k, v in stamp.items()]):
+                entries[fits] = old
+            else:
+                stale += [(fits, stamp)]
+        removed = len(set(manifest) - set(cfg_files))
+
+        if stale != [] or removed != 0:
+
+            print(f'Map summary file for {cfg} is out of date! ' + \
+                    f'Reading {len(stale)} map(s), dropping {removed}...')
+
+            # Save partial results periodically so a rerun after a crash
+            # or preemption resumes where this one stopped
+            stamps = dict(stale)
+            failed = 0
+            last_save = time.time()
+            for fits, n, error in iter_counts(list(stamps), workers, pool):
+                if error != None:
+                    failed += 1
+                    continue
+                entries[fits] = {**stamps[fits], 'count':n}
+                if time.time() - last_save > checkpoint:
+                    dump_json(mod_file, entries)
+                    last_save = time.time()
+
+            # Failed maps stay out of the record and are retried next time
+            if failed != 0:
+                print(f'{failed} map(s) in {cfg} could not be read')
+
+            dump_json(mod_file, entries)
+
+        # The per-file record is authoritative; refresh the date -> count
+        # summary whenever it is missing or disagrees with the record
+        cfg_data = map_counts(cfg_files, entries, dates)
+        outfile = f'{summary_dir}/mapcounts_{cfg}.json'
+        old_data = None
+        if os.path.isfile(outfile):
+            with open(outfile, 'r') as f:
+                old_data = json.load(f)
+        if old_data != cfg_data:
+            dump_json(outfile, cfg_data)
+
+        cfgs += [cfg_code(cfg)] * len(cfg_data)
+        days += list(cfg_data.keys())
+        counts += list(cfg_data.values())
+
+    return make_table(day_dtype, cfg=cfgs, day=day_code(days), nEvents=counts)
+
+
+
+""" Run table of nEvents and livetime from the root summary files """
 def root_scanner(summary_dir):
 
-    # Find nEvents and livetime for each root file
-    root_data = {}
-
     root_summary = sorted(glob(f'{summary_dir}/root-summary_*.txt'))
 
-    # Run through config
+    # Parse each config's summary in bulk
+    tables = [np.zeros(0, dtype=run_dtype)]
     for summary in root_summary:
+        cfg = cfg_code(re.findall('IC86-\d{4}', summary)[-1])
+        tables += [load_summary(summary, cfg)]
 
-        # Identify detector configuration and create storage
-        cfg = re.findall('IC86-\d{4}', summary)[-1]
-        root_data[cfg] = {}
-
-        # Import run summaries
-        with open(summary, 'r') as f:
-            cfg_data = f.readlines()
-
-        # obtain relevant data by dividing up the lines
-        cfg_data = [line.strip().split(' - ') for line in cfg_data]
-
-        for day, run, ct, t in cfg_data:
-
-            # Use integer values for runs
-            run = int(run)
-
-            # create days as keys
-            if day not in root_data[cfg].keys():
-                root_data[cfg][day] = {}
-
-            # create run as keys in days
-            if run not in root_data[cfg][day].keys():
-                root_data[cfg][day][run] = {'nEvents':0, 'livetime':0}
-
-            # combine livetime and nEvents for runs already in data
-            root_data[cfg][day][run]['nEvents'] += int(ct)
-            root_data[cfg][day][run]['livetime'] += int(t)
-
-    return root_data
+    # Combine livetime and nEvents for runs split over several lines
+    return sum_duplicates(sort_table(np.concatenate(tables)))
 
 
 if __name__ == "__main__":
@@ -1,30 +1,34 @@
-#!/usr/bin/env python 
+#!/usr/bin/env python
 
 import argparse
-import ROOT
+import os
 
 import numpy as np
 from astropy.time import Time
+from concurrent.futures import ProcessPoolExecutor
 
+from dst_readers import get_reader
+from extract_cache import file_identity, load_entry, save_entry
+from job_plan import load_job
+from run_aggregates import aggregate, merge, summary_lines
+from run_aggregates import save_gaps, save_counts, gap_threshold, bin_width
 
-if __name__ == "__main__":
 
-    p = argparse.ArgumentParser(
-            description='Extracts and stores nEvents and livetime from ' + \
-            'ROOT files, organized by each run in each day')
-    p.add_argument('-i', '--infiles', dest='infiles',
-            nargs='+',
-            help='File(s) to retrieve the information from')
-    p.add_argument('-o', '--out', dest='out',
-            help='Name of output text file to store info')
-    args = p.parse_args()
+""" Convert an integer MJD day to yr-month-day """
+def mjd2iso(date):
+    return Time(date, format='mjd', out_subfmt='date').iso
 
 
+""" Reference mode: original event-by-event loop """
+def loop_extract(infiles):
+
+    import ROOT
+
     # Data storage
     d = {}
 
     # Run through each input file
-    for infile in args.infiles:
+    for infile in infiles:
 
         print(f'Working on {infile}...')
 
@@ -58,15 +62,191 @@ if __name__ == "__main__":
             if time > d[date][run]['stop']:
                 d[date][run]['stop'] = time
 
+        f.Close()
+
     # Calculate livetime and nEvents for each run in a day
     day_info = []
     for date in d.keys():
         for run, info in d[date].items():
-            ymd = Time(date, format='mjd', out_subfmt='date').iso
+            ymd = mjd2iso(date)
             livetime = int((info['stop'] - info['start'])*86400)
             day_info.append(f'{ymd} - {run} - {info["nEvents"]} - {livetime}')
 
-    # Save information in text file
-    np.savetxt(args.out, day_info, fmt='%s')
+    return day_info
+
+
+""" Number of cores available to this job """
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+""" Split (src, file) pairs into entry ranges, sized from the entry count """
+def plan_shards(files, backend, workers, shard_size=0, min_shard=100000):
+
+    entries = []
+    for src, infile in files:
+        with get_reader(backend)(infile) as f:
+            entries.append(f.num_entries())
+
+    # Roughly two shards per worker leaves room to balance uneven files
+    if shard_size <= 0:
+        shard_size = max(min_shard, -(-sum(entries) // (2*workers)))
+
+    tasks = []
+    for (src, infile), n in zip(files, entries):
+        for start in range(0, n, shard_size):
+            tasks.append((src, infile, start, min(start + shard_size, n)))
+
+    return tasks
+
+
+""" Partial per-(day, run) aggregate (count, min/max time) for entry range """
+def extract_range(src, infile, start, stop, chunk_size, backend, options={}):
+
+    if stop is None:
+        print(f'Working on {infile}...')
+    else:
+        print(f'Working on {infile} [{start}, {stop})...')
+
+    agg = merge([])
+    with get_reader(backend)(infile) as f:
+        for entry0, mjd, run in f.chunks(chunk_size, start, stop):
+            agg = merge([agg, aggregate(mjd, run, entry0, src, **options)],
+                    options.get('gap_threshold', gap_threshold))
+
+    return agg
+
+
+""" Columnar mode: aggregate whole chunks and merge per-(day, run) totals """
+def columnar_extract(infiles, chunk_size, backend, workers=1, shard_size=0,
+        cache_dir=None, options={}):
+
+    files = list(enumerate(infiles))
+    aggs = {}
+    threshold = options.get('gap_threshold', gap_threshold)
+
+    # Reuse partial aggregates of files that have not changed
+    if cache_dir != None:
+        identities = {src: file_identity(infile) for src, infile in files}
+        for src, infile in files:
+            agg = load_entry(cache_dir, identities[src], options)
+            if agg is not None:
+                agg['src'] = src
+                aggs[src] = agg
+        files = [(src, infile) for src, infile in files if src not in aggs]
+        print(f'{len(aggs)} file(s) found in cache, {len(files)} to read')
+
+    if workers <= 1:
+        for src, infile in files:
+            aggs[src] = extract_range(src, infile, 0, None, chunk_size,
+                    backend, options)
+
+    # Spread entry ranges of all files over a process pool, largest first.
+    # Entries keep their position in the file, so partial aggregates merge
+    # to exactly the serial result regardless of completion order
+    elif len(files) != 0:
+        tasks = plan_shards(files, backend, workers, shard_size)
+        tasks.sort(key=lambda task: task[3] - task[2], reverse=True)
+        print(f'Processing {len(tasks)} shard(s) with {workers} workers')
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(extract_range, *task, chunk_size, backend,
+                    options) for task in tasks]
+            parts = [(task[0], future.result())
+                    for task, future in zip(tasks, futures)]
+        for src, infile in files:
+            aggs[src] = merge([agg for i, agg in parts if i == src], threshold)
+
+    # Store newly read files for the next pass
+    if cache_dir != None:
+        for src, infile in files:
+            save_entry(cache_dir, identities[src], aggs[src], options)
+
+    return merge(list(aggs.values()), threshold)
+
+
+if __name__ == "__main__":
+
+    p = argparse.ArgumentParser(
+            description='Extracts and stores nEvents and livetime from ' + \
+            'ROOT files, organized by each run in each day')
+    p.add_argument('-i', '--infiles', dest='infiles',
+            nargs='+',
+            help='File(s) to retrieve the information from')
+    p.add_argument('-o', '--out', dest='out',
+            help='Name of output text file to store info')
+    p.add_argument('--engine', dest='engine',
+            default='columnar', choices=['columnar', 'loop'],
+            help='Chunked array extraction, or the original event loop ' + \
+            '(reference mode)')
+    p.add_argument('--chunk', dest='chunk',
+            type=int, default=1000000,
+            help='Number of tree entries read per chunk (columnar engine)')
+    p.add_argument('--backend', dest='backend',
+            default='auto', choices=['auto', 'uproot', 'root'],
+            help='ROOT file reader for the columnar engine (auto prefers ' + \
+            'uproot, falling back to PyROOT)')
+    p.add_argument('--workers', dest='workers',
+            type=int, default=1,
+            help='Number of processes used to read input files in parallel ' + \
+            '(0 uses all available cores)')
+    p.add_argument('--shard', dest='shard',
+            type=int, default=0,
+            help='Tree entries per worker task (0 chooses automatically)')
+    p.add_argument('--cache', dest='cache',
+            default=None,
+            help='Directory of cached per-file aggregates. Only files ' + \
+            'that are new or changed (path, size, mtime, inode) are read')
+    p.add_argument('--manifest', dest='manifest',
+            default=None,
+            help='Job plan written by a submitter, replaces -i/-o')
+    p.add_argument('--job', dest='job',
+            type=int, default=0,
+            help='Index of the job to run from the manifest')
+    p.add_argument('--gap-threshold', dest='gap_threshold',
+            type=float, default=gap_threshold,
+            help='Gaps between events longer than this (seconds) are ' + \
+            'summed and removed from the gap-corrected livetime')
+    p.add_argument('--bin-width', dest='bin_width',
+            type=int, default=bin_width,
+            help='Width (seconds) of the time bins of the per-run event ' + \
+            'counts saved to *_counts.npz. Must divide a day evenly')
+    args = p.parse_args()
 
-    print(f'Finished. Information saved to {args.out}')
+    if args.bin_width <= 0 or 86400 % args.bin_width != 0:
+        p.error(f'--bin-width {args.bin_width} is not a positive divisor ' + \
+                'of 86400 s')
+    options = {'gap_threshold':args.gap_threshold, 'bin_width':args.bin_width}
+
+    # A job from a submitter plan can cover several dates
+    if args.manifest != None:
+        tasks = load_job(args.manifest, args.job)
+    else:
+        tasks = [{'infiles':args.infiles, 'out':args.out}]
+
+    if args.engine != 'loop':
+        backend = get_reader(args.backend).name
+        print(f'Reading with the {backend} backend')
+        workers = args.workers if args.workers > 0 else available_cores()
+
+    for task in tasks:
+
+        if args.engine == 'loop':
+            day_info = loop_extract(task['infiles'])
+
+        # Gap statistics and binned counts from the same pass go to
+        # *_gaps.npz and *_counts.npz sidecars
+        else:
+            agg = columnar_extract(task['infiles'], args.chunk, backend,
+                    workers=workers, shard_size=args.shard, cache_dir=args.cache,
+                    options=options)
+            day_info = summary_lines(agg, mjd2iso)
+            save_gaps(task['out'], agg, args.gap_threshold)
+            save_counts(task['out'], agg)
+
+        # Save information in text file
+        np.savetxt(task['out'], day_info, fmt='%s')
+
+        print(f'Finished. Information saved to {task["out"]}')
@@ -0,0 +1,219 @@
+########################################################################
+###    Vectorized per-(day, run) aggregation of CutDST events.       ###
+###    Chunks of ModJulDay/RunId are reduced to partial aggregates   ###
+###    (count, first/last event time, time gaps between events and   ###
+###    fixed-width time-binned counts) that can be merged exactly.   ###
+########################################################################
+
+
+import numpy as np
+import os
+
+
+# Lower edges (seconds) of the gap histogram; the last bin is open ended
+gap_edges = np.array([0, 1e-4, 1e-3, 1e-2, 0.1, 1, 10, 100, 1000, 10000])
+
+# Gaps longer than this (seconds) count as detector downtime
+gap_threshold = 1.0
+
+# Width (seconds) of the time bins counting events through each day
+bin_width = 600
+
+
+""" One row per (day, run). The source file index and entry of the first
+    event are kept so merged output follows the order the events were read """
+def make_dtype(bin_width=bin_width):
+    return np.dtype([
+            ('day', 'i8'), ('run', 'i8'), ('nEvents', 'i8'),
+            ('start', 'f8'), ('stop', 'f8'),
+            ('src', 'i8'), ('first', 'i8'),
+            ('max_gap', 'f8'), ('gap_sum', 'f8'),
+            ('gap_hist', 'i8', (len(gap_edges),)),
+            ('counts', 'i4', (86400 // bin_width,))])
+
+agg_dtype = make_dtype()
+
+
+""" Group boundaries for rows already sorted by the given key columns """
+def group_starts(*keys):
+
+    n = len(keys[0])
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    new = np.zeros(n, dtype=bool)
+    new[0] = True
+    for key in keys:
+        new[1:] |= key[1:] != key[:-1]
+
+    return np.flatnonzero(new)
+
+
+""" Reduce a chunk of events to one row per (day, run) """
+def aggregate(mjd, run, entry0=0, src=0, gap_threshold=gap_threshold,
+        bin_width=bin_width):
+
+    mjd = np.asarray(mjd, dtype=np.float64)
+    run = np.asarray(run).astype(np.int64)
+    # Truncation matches int(ModJulDay) in the event loop
+    day = mjd.astype(np.int64)
+
+    # Events sorted in time within each (day, run)
+    order = np.lexsort((mjd, run, day))
+    t = mjd[order]
+    idx = group_starts(day[order], run[order])
+    ends = np.append(idx[1:], len(order))
+
+    agg = np.zeros(len(idx), dtype=make_dtype(bin_width))
+    if len(idx) == 0:
+        return agg
+
+    agg['day'] = day[order][idx]
+    agg['run'] = run[order][idx]
+    agg['nEvents'] = ends - idx
+    agg['start'] = t[idx]
+    agg['stop'] = t[ends - 1]
+    agg['src'] = src
+    agg['first'] = np.minimum.reduceat(order, idx) + entry0
+
+    # Gap (seconds) before each event, zero for the first event of a run
+    gaps = np.zeros(len(t))
+    gaps[1:] = np.diff(t)*86400
+    gaps[idx] = 0
+    agg['max_gap'] = np.maximum.reduceat(gaps, idx)
+    agg['gap_sum'] = np.add.reduceat(np.where(gaps > gap_threshold, gaps, 0),
+            idx)
+
+    inner = np.ones(len(t), dtype=bool)
+    inner[idx] = False
+    group = np.repeat(np.arange(len(idx)), ends - idx)[inner]
+    bins = np.searchsorted(gap_edges, gaps[inner], side='right') - 1
+    nb = len(gap_edges)
+    hist = np.bincount(group*nb + bins, minlength=len(idx)*nb)
+    agg['gap_hist'] = hist.reshape(len(idx), nb)
+
+    # Event counts in fixed-width bins from the start of each day
+    nb = 86400 // bin_width
+    group = np.repeat(np.arange(len(idx)), ends - idx)
+    bins = ((t - day[order])*86400 // bin_width).astype(np.int64)
+    bins = np.clip(bins, 0, nb - 1)
+    counts = np.bincount(group*nb + bins, minlength=len(idx)*nb)
+    agg['counts'] = counts.reshape(len(idx), nb)
+
+    return agg
+
+
+""" Combine partial aggregates, summing counts and widening time ranges """
+def merge(parts, gap_threshold=gap_threshold):
+
+    parts = [p for p in parts if len(p) != 0]
+    if len(parts) == 0:
+        return np.zeros(0, dtype=agg_dtype)
+
+    rows = np.concatenate(parts)
+
+    # Earliest (src, first) ends up at the top of each group
+    order = np.lexsort((rows['first'], rows['src'], rows['run'], rows['day']))
+    rows = rows[order]
+    idx = group_starts(rows['day'], rows['run'])
+
+    agg = rows[idx].copy()
+    agg['nEvents'] = np.add.reduceat(rows['nEvents'], idx)
+    agg['start'] = np.minimum.reduceat(rows['start'], idx)
+    agg['stop'] = np.maximum.reduceat(rows['stop'], idx)
+    agg['max_gap'] = np.maximum.reduceat(rows['max_gap'], idx)
+    agg['gap_sum'] = np.add.reduceat(rows['gap_sum'], idx)
+    agg['gap_hist'] = np.add.reduceat(rows['gap_hist'], idx, axis=0)
+    agg['counts'] = np.add.reduceat(rows['counts'], idx, axis=0)
+
+    # Add the gaps between partials of the same run. This is exact when the
+    # partials cover disjoint time ranges (time-ordered files and shards);
+    # gaps hidden inside overlapping partials cannot be recovered
+    sizes = np.diff(np.append(idx, len(rows)))
+    for g in np.flatnonzero(sizes > 1):
+        group = rows[idx[g]:idx[g] + sizes[g]]
+        group = group[np.argsort(group['start'], kind='stable')]
+        last = group['stop'][0]
+        for start, stop in zip(group['start'][1:], group['stop'][1:]):
+            gap = (start - last)*86400
+            if gap >= 0:
+                agg['max_gap'][g] = max(agg['max_gap'][g], gap)
+                if gap > gap_threshold:
+                    agg['gap_sum'][g] += gap
+                b = np.searchsorted(gap_edges, gap, side='right') - 1
+                agg['gap_hist'][g, b] += 1
+            last = max(last, stop)
+
+    return agg
+
+
+""" Order rows as the event loop would: days, then runs, by first appearance """
+def reading_order(agg):
+
+    if len(agg) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Position of the first event seen for each day
+    by_day = np.lexsort((agg['first'], agg['src'], agg['day']))
+    idx = group_starts(agg['day'][by_day])
+    sizes = np.diff(np.append(idx, len(agg)))
+    day_src = np.empty(len(agg), dtype=np.int64)
+    day_first = np.empty(len(agg), dtype=np.int64)
+    day_src[by_day] = np.repeat(agg['src'][by_day][idx], sizes)
+    day_first[by_day] = np.repeat(agg['first'][by_day][idx], sizes)
+
+    return np.lexsort((agg['first'], agg['src'], day_first, day_src))
+
+
+""" Livetime in whole seconds, computed as in the event loop """
+def livetimes(agg):
+    return np.array([int((float(row['stop']) - float(row['start']))*86400)
+            for row in agg], dtype=np.int64)
+
+
+""" Text lines in the 'date - run - nEvents - livetime' summary format """
+def summary_lines(agg, day_formatter):
+
+    agg = agg[reading_order(agg)]
+
+    day_info = []
+    dates = {}
+    for row, livetime in zip(agg, livetimes(agg)):
+        date = int(row['day'])
+        if date not in dates:
+            dates[date] = day_formatter(date)
+        day_info.append(
+                f'{dates[date]} - {row["run"]} - {row["nEvents"]} - {livetime}')
+
+    return day_info
+
+
+""" Sidecar file name for a text summary, e.g. sum_X.txt -> sum_X_gaps.npz """
+def sidecar(out, kind):
+    return f'{os.path.splitext(out)[0]}_{kind}.npz'
+
+
+""" Save per-run gap statistics and gap-corrected livetime next to a summary """
+def save_gaps(out, agg, gap_threshold=gap_threshold):
+
+    agg = agg[reading_order(agg)]
+    livetime = livetimes(agg)
+
+    np.savez(sidecar(out, 'gaps'),
+            day=agg['day'], run=agg['run'], nEvents=agg['nEvents'],
+            livetime=livetime,
+            livetime_gapcorr=(agg['stop'] - agg['start'])*86400 - agg['gap_sum'],
+            max_gap=agg['max_gap'], gap_sum=agg['gap_sum'],
+            gap_hist=agg['gap_hist'], gap_edges=gap_edges,
+            gap_threshold=gap_threshold)
+
+
+""" Save the time-binned event counts of every run next to a summary """
+def save_counts(out, agg):
+
+    agg = agg[reading_order(agg)]
+    bin_width = 86400 // agg.dtype['counts'].shape[0]
+
+    np.savez_compressed(sidecar(out, 'counts'),
+            day=agg['day'], run=agg['run'], counts=agg['counts'],
+            bin_width=bin_width)
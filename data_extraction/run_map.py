@@ -0,0 +1,88 @@
+########################################################################
+###    Run -> detector configuration map stored as sorted ranges of  ###
+###    consecutive runs. Whole arrays of runs are looked up with one ###
+###    searchsorted, and the map is saved as a small .npy file next  ###
+###    to run2cfg.json.                                              ###
+########################################################################
+
+
+import numpy as np
+import json
+import os
+
+from atomic_io import atomic_open
+from run_table import cfg_code
+
+
+# Runs first..last (inclusive) all belong to configuration cfg
+range_dtype = np.dtype([('first', 'i8'), ('last', 'i8'), ('cfg', 'i2')])
+
+
+""" Collapse a {run: 'IC86-YYYY'} dictionary into run ranges. A range ends
+    where the configuration changes or a run number is missing """
+def from_dict(run2cfg):
+
+    runs = np.array([int(run) for run in run2cfg], dtype=np.int64)
+    cfgs = np.array([cfg_code(cfg) for cfg in run2cfg.values()],
+            dtype=np.int16)
+    order = np.argsort(runs)
+    runs, cfgs = runs[order], cfgs[order]
+
+    new = np.ones(len(runs), dtype=bool)
+    new[1:] = (np.diff(runs) != 1) | (cfgs[1:] != cfgs[:-1])
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(runs)) - 1
+
+    ranges = np.zeros(len(first), dtype=range_dtype)
+    ranges['first'] = runs[first]
+    ranges['last'] = runs[last]
+    ranges['cfg'] = cfgs[first]
+
+    return ranges
+
+
+""" Config code of every run, -1 for runs in no range """
+def lookup_cfg(ranges, runs):
+
+    runs = np.asarray(runs, dtype=np.int64)
+    if len(ranges) == 0:
+        return np.full(runs.shape, -1, dtype=np.int64)
+
+    # Last range starting at or before each run
+    k = np.searchsorted(ranges['first'], runs, side='right') - 1
+    k_safe = np.maximum(k, 0)
+    found = (k >= 0) & (runs <= ranges['last'][k_safe])
+
+    return np.where(found, ranges['cfg'][k_safe], -1)
+
+
+""" Binary run map belonging to a run2cfg.json file """
+def map_path(jsonfile):
+    return f'{os.path.splitext(jsonfile)[0]}.ranges.npy'
+
+
+""" Save run ranges atomically """
+def save_map(path, ranges):
+    with atomic_open(path, 'wb') as f:
+        np.save(f, ranges)
+
+
+""" Run ranges for a run2cfg.json file, from its binary map when that is
+    at least as new as the json. Otherwise the map is rebuilt and saved """
+def load_map(jsonfile):
+
+    path = map_path(jsonfile)
+    if os.path.isfile(path) and \
+            os.path.getmtime(path) >= os.path.getmtime(jsonfile):
+        return np.load(path)
+
+    with open(jsonfile, 'r') as f:
+        ranges = from_dict(json.load(f))
+
+    # The binary map is an optimization; an unwritable directory is fine
+    try:
+        save_map(path, ranges)
+    except OSError as e:
+        print(f'Warning: unable to save run map {path} ({e})')
+
+    return ranges
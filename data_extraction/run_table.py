@@ -0,0 +1,144 @@
+########################################################################
+###    Columnar tables for run- and day-level data in the rate       ###
+###    pipeline. Rows are structured numpy arrays with integer-coded ###
+###    detector configuration (IC86-2015 -> 2015), day (days since   ###
+###    1970-01-01) and run, kept sorted by (cfg, day, run) so that   ###
+###    lookups and joins are binary searches on a single int64 key.  ###
+########################################################################
+
+
+import numpy as np
+import warnings
+import io
+
+from run_aggregates import group_starts
+
+
+# One row per (cfg, day, run). livetime is NaN where it is unknown
+run_dtype = np.dtype([
+        ('cfg', 'i2'), ('day', 'i4'), ('run', 'i8'),
+        ('nEvents', 'i8'), ('livetime', 'f8')])
+
+# Columns of a 'date - run - nEvents - livetime' summary file
+summary_dtype = np.dtype([
+        ('day', 'M8[D]'), ('run', 'i8'), ('nEvents', 'i8'), ('livetime', 'i8')])
+
+# One row per (cfg, day)
+day_dtype = np.dtype([
+        ('cfg', 'i2'), ('day', 'i4'),
+        ('nEvents', 'i8'), ('livetime', 'f8')])
+
+
+""" Integer code for a detector configuration, IC86-2015 -> 2015 """
+def cfg_code(cfg):
+    return int(cfg.split('-')[-1])
+
+def cfg_name(code):
+    return f'IC86-{code}'
+
+
+""" Days since 1970-01-01 for YYYY-MM-DD string(s) """
+def day_code(day):
+    return np.asarray(day, dtype='datetime64[D]').astype(np.int32)
+
+def day_name(code):
+    return str(np.datetime64(int(code), 'D'))
+
+
+""" Single sortable key: 12 bits cfg | 20 bits day | 24 bits run """
+def table_key(cfg, day, run=0):
+    return (np.asarray(cfg, dtype=np.int64) << 44) | \
+            (np.asarray(day, dtype=np.int64) << 24) | \
+            np.asarray(run, dtype=np.int64)
+
+def row_keys(table):
+    run = table['run'] if 'run' in table.dtype.names else 0
+    return table_key(table['cfg'], table['day'], run)
+
+
+""" Table rows sorted by (cfg, day, run), keeping the order of equal keys """
+def sort_table(table):
+    return table[np.argsort(row_keys(table), kind='stable')]
+
+
+""" Build a table sorted by (cfg, day, run) from columns """
+def make_table(dtype, **columns):
+
+    n = len(next(iter(columns.values()))) if columns else 0
+    table = np.zeros(n, dtype=dtype)
+    for name, values in columns.items():
+        table[name] = values
+
+    return sort_table(table)
+
+
+""" Collapse duplicate rows of a sorted table, summing counts and livetime """
+def sum_duplicates(table):
+
+    keys = row_keys(table)
+    idx = group_starts(keys)
+    merged = table[idx].copy()
+    if len(idx) != 0:
+        merged['nEvents'] = np.add.reduceat(table['nEvents'], idx)
+        merged['livetime'] = np.add.reduceat(table['livetime'], idx)
+
+    return merged
+
+
+""" Collapse duplicate rows of a sorted table, keeping the last one """
+def keep_last(table):
+
+    keys = row_keys(table)
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+
+    return table[last]
+
+
+""" Run table from a 'date - run - nEvents - livetime' summary file in a
+    single numpy parse, with runs split over several lines combined """
+def load_summary(path, cfg):
+
+    with open(path, 'r') as f:
+        text = f.read().replace(' - ', ' ')
+
+    # An empty summary is not an error
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        rows = np.loadtxt(io.StringIO(text), dtype=summary_dtype, ndmin=1)
+
+    table = make_table(run_dtype, cfg=np.full(len(rows), cfg),
+            day=rows['day'].astype(np.int64), run=rows['run'],
+            nEvents=rows['nEvents'], livetime=rows['livetime'])
+
+    return sum_duplicates(table)
+
+
+""" Row index of each (cfg, day[, run]) in a sorted table, -1 if absent """
+def lookup(table, cfg, day, run=0):
+
+    keys = row_keys(table)
+    target = table_key(cfg, day, run)
+    i = np.searchsorted(keys, target)
+    i_safe = np.minimum(i, max(len(keys) - 1, 0))
+    found = (i < len(keys)) & (keys[i_safe] == target) if len(keys) else \
+            np.zeros(np.shape(target), dtype=bool)
+
+    return np.where(found, i, -1)
+
+
+""" Values of column at rows idx from lookup, fill where the row is absent """
+def gather(column, idx, fill=0):
+
+    idx = np.asarray(idx)
+    out = np.full(idx.shape, fill, dtype=column.dtype)
+    found = idx >= 0
+    out[found] = column[idx[found]]
+
+    return out
+
+
+""" Start and stop rows of every (cfg, day) group in a sorted run table """
+def day_groups(table):
+    idx = group_starts(table['cfg'], table['day'])
+    return idx, np.append(idx[1:], len(table))
@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 
-from npx4.pysubmit import pysubmit
 import argparse
-from glob import glob
-import re
+import sys
 import os
 
+# Shared planning tools live alongside the extraction scripts
+sys.path.append(f'{os.path.dirname(os.path.abspath(__file__))}/../data_extraction')
+from job_plan import task_weight, write_plan, plan_path
+from file_catalog import default_catalog, open_catalog, refresh, \
+        files_by_date, root_match
+from job_array import submit_prefix
+from executors import ClusterExecutor, LocalExecutor
+
 
 if __name__ == "__main__":
 
@@ -13,23 +19,72 @@ if __name__ == "__main__":
             description='Cluster submission for root_extractor.py')
     p.add_argument('--test', dest='test',
             default=False, action='store_true',
-            help='Option for running off cluster to test')
+            help='Option for running off cluster to test: the first two ' + \
+            'dates run with the local executor')
     p.add_argument('-y', '--year', dest='year',
             type=int,
             help='Detector season (e.g., 2011 = IC86-2011)')
     p.add_argument('-o', '--outDir', dest='outDir',
             default='/data/user/zhardnett/root_summaries',
             help='Output directory')
+    p.add_argument('--backend', dest='backend',
+            default='root', choices=['root', 'uproot'],
+            help='ROOT reader used by the jobs. uproot runs on plain ' + \
+            'worker nodes without the cvmfs icetray environment')
+    p.add_argument('--workers', dest='workers',
+            type=int, default=1,
+            help='CPUs requested per job to read input files in parallel')
+    p.add_argument('--cache', dest='cache',
+            default=None,
+            help='Per-file aggregate cache directory shared by all jobs')
+    p.add_argument('--overwrite', dest='overwrite',
+            default=False, action='store_true',
+            help='Resubmit dates whose summary file already exists')
+    p.add_argument('--balance', dest='balance',
+            default='bytes', choices=['bytes', 'entries'],
+            help='Balance jobs by total input bytes or CutDST entries')
+    p.add_argument('--target', dest='target',
+            type=float, default=60,
+            help='Target job duration in minutes')
+    p.add_argument('--throughput', dest='throughput',
+            type=float, default=None,
+            help='Bytes (or entries) per second processed by one job')
+    p.add_argument('--plan', dest='plan',
+            default=None,
+            help='Job plan manifest (default: a new ' + \
+            'plan_IC86-YYYY_<time>_<pid>.json in outDir, or in submitDir ' + \
+            'with --test or --dry-run)')
+    p.add_argument('--submitDir', dest='submitDir',
+            default=submit_prefix,
+            help='Directory for the job-array submit file, arguments and logs')
+    p.add_argument('--catalog', dest='catalog',
+            default=default_catalog,
+            help='File catalog database, refreshed for the season before use')
+    p.add_argument('--executor', dest='executor',
+            default='cluster', choices=['cluster', 'local'],
+            help='Submit jobs as a cluster job array, or run them in a ' + \
+            'pool of processes on this node')
+    p.add_argument('--jobs', dest='jobs',
+            type=int, default=4,
+            help='Jobs running at once with the local executor')
+    p.add_argument('--retries', dest='retries',
+            type=int, default=1,
+            help='Extra attempts for a failed job with the local executor')
+    p.add_argument('--dry-run', dest='dry_run',
+            default=False, action='store_true',
+            help='Write the submit description and task manifests only')
     args = p.parse_args()
 
 
-    # Collect all files from specified year
+    # Collect all files from specified year through the file catalog
     prefix = '/data/ana/CosmicRay/Anisotropy/IceCube'
-    files = glob(f'{prefix}/IC86-{args.year}/**/*.root', recursive=True)
-    files.sort()
+    season = f'{prefix}/IC86-{args.year}'
+    db = open_catalog(args.catalog)
+    refresh(db, 'root', season, root_match)
 
     # Group all files according to a given date
-    dates = sorted(set([re.findall('\d{4}-\d{2}-\d{2}', f)[-1] for f in files]))
+    date_files = files_by_date(db, 'root', f'IC86-{args.year}', top=season)
+    dates = sorted(date_files)
     if args.test:
         dates = dates[:2]
 
@@ -39,26 +94,52 @@ if __name__ == "__main__":
     header = [f'#!/bin/sh {cvmfs}', f'#METAPROJECT {meta}']
     # ROOT tools not automatically loaded
     header += ['export PYTHONPATH="$PYTHONPATH:${SROOT}/lib"']
+    # uproot only needs a python with numpy/uproot, no icetray or PyROOT
+    if args.backend == 'uproot':
+        header = ['#!/bin/sh']
     # Request increased memory: 8 GB, overkill (shouldn't need more than 4)
     sublines = ["request_memory = 2000"]  
+    if args.workers > 1:
+        sublines += [f'request_cpus = {args.workers}']
 
-    # Run over all dates
+    # One task for every date still missing a summary
+    tasks = []
     for date in dates:
 
-        # Limit to relevant files
-        files_i = sorted([f for f in files if date in f])
-        if files_i == []:
-            print(f'No files found for {date}! Skipping...')
-            continue
-
-        # Run
-        files_i = ' '.join(files_i)
         out = f'{args.outDir}/sum_IC86-{args.year}_{date}.txt'
-        cmd = f'{os.getcwd()}/root_extractor.py -i {files_i} -o {out}'
-
         if os.path.isfile(out) and not args.overwrite:
             print(f'Files {out} already exists! Skipping...')
             continue
 
-        pysubmit(cmd, test=args.test, header=header, sublines=sublines)
+        files_i = date_files[date]
+        weight = task_weight(files_i, args.balance, args.backend)
+        tasks += [{'date':date, 'infiles':files_i, 'out':out, 'weight':weight}]
+
+    # Pack dates into jobs of similar size. Every submission gets its own
+    # plan, as queued jobs find their dates by index into it. Test and dry
+    # runs keep theirs out of outDir
+    plan = args.plan
+    if plan == None:
+        plan_dir = args.outDir
+        if args.test or args.dry_run:
+            plan_dir = args.submitDir
+        os.makedirs(plan_dir, exist_ok=True)
+        plan = plan_path(plan_dir, f'IC86-{args.year}')
+    jobs = write_plan(plan, tasks, balance=args.balance,
+            target_minutes=args.target, throughput=args.throughput)
 
+    # Run every job as one task, as a cluster job array or locally
+    cmd = f'{os.getcwd()}/root_extractor.py'
+    cmd += f' --backend {args.backend} --workers {args.workers}'
+    if args.cache != None:
+        cmd += f' --cache {args.cache}'
+    arglines = [f'--manifest {plan} --job {job}' for job in range(len(jobs))]
+    if args.executor == 'local' or args.test:
+        executor = LocalExecutor(args.submitDir, jobs=args.jobs,
+                retries=args.retries, dry_run=args.dry_run)
+    else:
+        executor = ClusterExecutor(args.submitDir, sublines,
+                dry_run=args.dry_run)
+    failed = executor.run(f'root_IC86-{args.year}', cmd, arglines, header)
+    if failed != []:
+        sys.exit(1)
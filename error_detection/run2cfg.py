@@ -4,43 +4,73 @@
 ## Associates runs with detector configuration by scanning level2 directories
 
 import numpy as np
-import re
+import argparse
 import json
+import sys
+import os
 
-from glob import glob
+# Shared tools live alongside the extraction scripts
+sys.path.append(f'{os.path.dirname(os.path.abspath(__file__))}/../data_extraction')
+from run_map import from_dict, map_path, save_map
+from file_catalog import default_catalog, open_catalog, refresh, find, \
+        level2_match, level2_descend
 
 
 if __name__ == "__main__":
 
     out = '/data/user/zhardnett/stability'
-    d = {}
 
-    # Collect all files from relevant years
+    p = argparse.ArgumentParser(
+            description='Associates runs with detector configurations')
+    p.add_argument('--workers', dest='workers',
+            type=int, default=16,
+            help='Number of directories listed in parallel')
+    p.add_argument('--catalog', dest='catalog',
+            default=default_catalog,
+            help='File catalog, relisting only directories whose ' + \
+            'mtime has changed')
+    p.add_argument('--rescan', dest='rescan',
+            default=False, action='store_true',
+            help='List every directory again')
+    args = p.parse_args()
+
+    # Collect all runs from relevant years
     years = [i for i in range(2011, 2024)]
-    configs = [f'IC86.{yy}' for yy in years[:-1]]
+    configs = set([f'IC86-{yy}' for yy in years[:-1]])
 
+    # Bring the catalog of level2 files up to date. Only one file per run is
+    # kept for each directory, as only the (run, config) pairs are needed
+    db = open_catalog(args.catalog)
     for yy in years:
-
-        print(f'Working on {yy}...')
         prefix = f'/data/exp/IceCube/{yy}/filtered/level2'
+        print(f'Working on {yy}...')
+        nlisted = refresh(db, 'level2', prefix, level2_match, level2_descend,
+                stat=False, unique=True, full=args.rescan,
+                workers=args.workers)
+        print(f'Listed {nlisted} changed directories')
 
-        files = glob(f'{prefix}/????/**/*', recursive=True)
-
-        print(f'Number of total files: {len(files)}')
-        for cfg in configs:
-            files_i = [f for f in files if cfg in f]
-            runs = sorted(set([re.findall('Run\d{8}',f)[-1] for f in files_i]))
-            runs = [r[-6:] for r in runs]       # Only save the relevant number
-            if len(runs) != 0:
-                print(f'Runs for {cfg} : {len(runs)}')
-
-            out_cfg = cfg.replace('.','-')
-            for run in runs:
-                d[run] = out_cfg
+    # A run seen under several configs keeps the one from the latest year
+    # and config
+    d, seen = {}, {}
+    for path, cfg, date, run in find(db, 'level2'):
+        # Files outside the day directories carry no date
+        if cfg not in configs or run == None or date == None:
+            continue
+        # Only save the relevant number
+        key = f'{run:08d}'[-6:]
+        yy = int(date[:4])
+        if key not in seen or (yy, cfg) >= seen[key]:
+            seen[key] = (yy, cfg)
+            d[key] = cfg
+    d = dict(sorted(d.items()))
 
-        print()
+    for cfg in sorted(set(d.values())):
+        print(f'Runs for {cfg} : {list(d.values()).count(cfg)}')
 
     print('File collection complete! Saving...')
     np.save(f'{out}/run2cfg.npy', d)
     with open(f'{out}/run2cfg.json', 'w') as f:
         json.dump(d, f)
+
+    # Run ranges for fast lookups of whole arrays of runs
+    save_map(map_path(f'{out}/run2cfg.json'), from_dict(d))
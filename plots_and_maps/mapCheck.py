@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
-import glob, argparse, re
-import healpy as hp
+import argparse, os, sys
 import numpy as np
 import matplotlib.pyplot as plt
 import itertools
@@ -9,6 +8,11 @@ import pandas as pd
 from datetime import datetime
 import matplotlib.dates as date 
 
+# Map counting tools live alongside the extraction scripts
+sys.path.append(f'{os.path.dirname(os.path.abspath(__file__))}/../data_extraction')
+from fits_counts import count_events
+from file_catalog import open_catalog, refresh, find, fits_match, fits_descend
+
 if __name__ == "__main__":
 
     p = argparse.ArgumentParser()
@@ -37,6 +41,10 @@ if __name__ == "__main__":
     args = p.parse_args()
 
     prefix = '/data/user/fmcnally/anisotropy/maps'
+
+    # fits maps are listed by the file catalog
+    db = open_catalog()
+    refresh(db, 'fits', prefix, fits_match, fits_descend)
     
     if args.everything:
         args.config = [f'IC86-{yy}' for yy in range(2011, 2022)]
@@ -55,8 +63,7 @@ if __name__ == "__main__":
         valid_dates = sorted(times[c])
         rate_lst = []
         # find relevant files
-        files = glob.glob(f'{prefix}/{c}/*sid_????-??-??.fits')
-        files.sort()
+        files = find(db, 'fits', c, top=prefix)
 
         # initiate variables
         n = []
@@ -66,14 +73,12 @@ if __name__ == "__main__":
         x=[]
         
         # go through each file
-        for i, f in enumerate(files):
+        for i, (f, cfg, day, run) in enumerate(files):
             # Progress tracker if not printing daily counts
             if not args.verbose:
                 print(f'Reading file {i} of {nfiles}...', end='\r')
             # read map to get event count (n_i)
-            map_i = hp.read_map(f, verbose=0)
-            n_i = map_i.sum()
-            day = re.split('_|\.', f)[-2]
+            n_i = float(count_events(f))
             # warn if day doesn't have good runs
             if day not in valid_dates:
                 print(f'Warning: {day} has no good runs in i3live!')